@@ -38,6 +38,7 @@ Example Commands:
 
 # Standard library imports
 import argparse
+import asyncio
 import logging
 import os
 from typing import Any, Dict
@@ -115,15 +116,21 @@ def handle_data_preparation(
     # Creating embeddings
     modified_scraped_data = prepend_title_and_meta_to_text(scraped_data)
     cohere_api_key = os.getenv("COHERE_API_KEY")
-    embeddings_with_metadata = create_embeddings(
-        scraped_data=modified_scraped_data,
-        **config["embeddings_creator"],
-        cohere_api_key=cohere_api_key,
+    embeddings_with_metadata = asyncio.run(
+        create_embeddings(
+            scraped_data=modified_scraped_data,
+            **config["embeddings_creator"],
+            cohere_api_key=cohere_api_key,
+            embeddings_cache_file_path=file_paths["embeddings_creator"][
+                "embeddings_cache_file_path"
+            ],
+        )
     )
     save_embeddings_and_metadata(
         data=embeddings_with_metadata,
         data_dir=file_paths["embeddings_creator"]["output_embeddings_processed_data_dir"],
         timestamp=timestamp,
+        **config["embeddings_storage"],
     )
 
     # Deduplicating embeddings
@@ -141,6 +148,7 @@ def handle_data_preparation(
         data=unique_records,
         data_dir=file_paths["embeddings_deduplicator"]["output_embeddings_deduplicated_data_dir"],
         timestamp=timestamp,
+        **config["embeddings_storage"],
     )
 
     # Indexing embeddings
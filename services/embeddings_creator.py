@@ -8,12 +8,15 @@ Functional Overview:
 - Sets up logging and reads configuration from YAML files.
 - Preprocesses text data by appending titles and metadata.
 - Tokenizes text, manages token chunks to fit API limits, and generates embeddings for each chunk.
+  Reading, tokenization and embedding overlap as stages of a pipeline connected by bounded queues.
 - Saves embeddings and metadata, organized by a generated timestamp.
 
 Components:
 - `TextProcessingService`: An abstract base class for text processing tasks.
 - `CohereTextProcessingService`: Implements the abstract base class to use Cohere's API for text
 processing.
+- `CachedCohereService`: Wraps the Cohere service with a persistent cache of embeddings.
+- `EmbeddingMatrix`: Accumulates embeddings in a contiguous float32 matrix.
 - Utility functions for reading configurations, preprocessing text, and saving results.
 
 Usage:
@@ -26,26 +29,385 @@ project root for secure API access.
 """
 
 # Standard library imports
+import asyncio
+import datetime
+import email.utils
+import gzip
+import hashlib
+import itertools
 import logging
+import math
 import os
+import random
+import sqlite3
+import threading
 from abc import ABC, abstractmethod
-from typing import Dict, List
+from array import array
+from collections import ChainMap, OrderedDict
+from contextlib import closing
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Sequence,
+    Sized,
+    Tuple,
+)
 
 # Related third-party imports
 from dotenv import load_dotenv
+import httpx
+import numpy as np
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from tenacity import (
+    RetryCallState,
+    retry,
+    retry_if_exception,
+    stop_after_attempt,
+    stop_after_delay,
+    wait_exponential_jitter,
+)
+from tokenizers import Tokenizer
 from tqdm import tqdm
+from urllib3.util import Retry
 
 # Local application/library specific imports
 from config.logging_config import setup_global_logger
 from utils.utils import (
     generate_timestamp,
-    prepend_title_and_meta_to_text,
-    read_json_file,
+    iter_json_records,
+    prepend_title_and_meta_to_record,
     read_yaml_file,
     save_embeddings_and_metadata,
 )
 
+# Maximum number of texts accepted by a single request to the Cohere embed endpoint
+MAX_TEXTS_PER_EMBED_REQUEST = 96
+# Maximum number of characters accepted by the Cohere tokenize endpoint
+MAX_TOKENIZE_TEXT_LENGTH = 65536
+# Version of the Cohere API used for tokenization, part of the tokenization cache keys
+COHERE_API_VERSION = "v1"
+# Endpoint of the Cohere API that embeds texts
+EMBED_URL = "https://api.cohere.ai/v1/embed"
+# Minimum size in bytes of a request body worth compressing
+MIN_COMPRESSED_REQUEST_SIZE = 1024
+# Maximum number of items waiting in each queue of the embedding pipeline
+PIPELINE_QUEUE_SIZE = 256
+# Marks the end of the items put into a queue of the embedding pipeline
+END_OF_STREAM = None
+# Separator of paragraphs, at which the beginnings of texts are split for tokenization
+PARAGRAPH_SEPARATOR = "\n\n"
+
+
+# Status codes of failed requests that may succeed when retried
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+# Longest wait in seconds between two attempts of a request, whatever the Retry-After header asks
+MAX_RETRY_WAIT = 60
+# Time in seconds after which a failing embed request is no longer retried
+MAX_RETRY_TIME = 300
+
+
+class CohereAPIError(Exception):
+    """Raised when a request to the Cohere API fails. Carries the status code of the response and
+    the delay in seconds requested by its Retry-After header, if any."""
+
+    def __init__(self, message: str, status_code: int, retry_after: float = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: str) -> float:
+    """Parses the value of a Retry-After header, given either in seconds or as an HTTP date.
+
+    Args:
+        value (str): The value of the header.
+
+    Returns:
+        float: The number of seconds to wait, or None if the value is missing or invalid.
+    """
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        pass
+    else:
+        # Values such as "inf" or "nan" are parsed by float but aren't valid delays
+        return max(seconds, 0.0) if math.isfinite(seconds) else None
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    now = datetime.datetime.now(retry_at.tzinfo)
+    return max((retry_at - now).total_seconds(), 0.0)
+
+
+def is_retryable_error(exception: BaseException) -> bool:
+    """Tells whether a failed request is worth retrying: rate limits, server errors and
+    connection errors are transient, other errors (e.g. an invalid request) are not."""
+    if isinstance(exception, CohereAPIError):
+        return exception.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(
+        exception, (httpx.TransportError, requests.ConnectionError, requests.Timeout)
+    )
+
+
+backoff_with_jitter = wait_exponential_jitter(initial=1, max=MAX_RETRY_WAIT)
+
+
+def wait_for_retry_after(retry_state: RetryCallState) -> float:
+    """Waits as long as the Retry-After header of the failed response requests, up to
+    MAX_RETRY_WAIT seconds, or backs off exponentially with jitter if the response has no such
+    header."""
+    retry_after = getattr(retry_state.outcome.exception(), "retry_after", None)
+    if retry_after is not None:
+        return min(retry_after, MAX_RETRY_WAIT)
+    return backoff_with_jitter(retry_state)
+
+
+# Each request backs off independently, with jitter, so concurrent batches don't retry in sync
+retry_embed_request = retry(
+    retry=retry_if_exception(is_retryable_error),
+    wait=wait_for_retry_after,
+    stop=stop_after_attempt(6) | stop_after_delay(MAX_RETRY_TIME),
+    reraise=True,
+)
+
+
+class TokenizerFingerprint(NamedTuple):
+    """Identifies the tokenizer that produced a tokenization, so that cached tokenizations are
+    never reused after switching the model or the tokenizer."""
+
+    model_name: str
+    api_version: str
+
+
+class LRUCache:
+    """A mapping whose values add up to at most `maxsize`, evicting the least recently used
+    entries first. Values are sized with `sizeof`, which counts each entry as 1 by default.
+    Safe to share between the threads tokenizing records."""
+
+    def __init__(self, maxsize: int, sizeof: Callable[[Any], int] = None):
+        self.maxsize = maxsize
+        self.sizeof = sizeof if sizeof else lambda value: 1
+        self.size = 0
+        # Each entry holds a value together with its size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self.lock:
+            try:
+                self.entries.move_to_end(key)
+                return self.entries[key][0]
+            except KeyError:
+                return default
+
+    def put(self, key: Hashable, value: Any) -> None:
+        value_size = max(self.sizeof(value), 1)
+        # A value larger than the whole cache would only evict everything else
+        if value_size > self.maxsize:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            self.entries[key] = (value, value_size)
+            self.size += value_size
+            while self.size > self.maxsize:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+
+
+class Tokenization(NamedTuple):
+    """The tokens of a text, stored compactly: the token ids as an array of 4-byte ints, and the
+    text covered by the tokens together with the end offset of each token in it. Token strings are
+    sliced from the text when needed rather than kept as separate strings."""
+
+    ids: array
+    text: str
+    ends: array
+
+    @classmethod
+    def from_token_strings(cls, ids: List[int], token_strings: List[str]) -> "Tokenization":
+        """Builds a tokenization from token ids and the token strings they represent."""
+        ends = array(
+            "i", itertools.accumulate(len(token_string) for token_string in token_strings)
+        )
+        return cls(array("i", ids), "".join(token_strings), ends)
+
+    @classmethod
+    def concatenate(cls, tokenizations: List["Tokenization"], text: str) -> "Tokenization":
+        """Concatenates the tokenizations of consecutive parts of a text.
+
+        Args:
+            tokenizations (List[Tokenization]): The tokenizations of the parts of the text.
+            text (str): The whole text, which the texts of the tokenizations join up to.
+
+        Returns:
+            Tokenization: The tokenization of the whole text.
+        """
+        ids, ends = array("i"), array("i")
+        offset = 0
+        for tokenization in tokenizations:
+            ids.extend(tokenization.ids)
+            if tokenization.ends:
+                shifted_ends = np.frombuffer(tokenization.ends, dtype=np.intc) + offset
+                ends.frombytes(shifted_ends.astype(np.intc).tobytes())
+            offset += len(tokenization.text)
+        return cls(ids, text, ends)
+
+    def token_strings(self) -> List[str]:
+        """Returns the token strings of all tokens."""
+        return [self.join_token_strings(i, i + 1) for i in range(len(self.ids))]
+
+    def join_token_strings(self, start: int, stop: int) -> str:
+        """Returns the text covered by the tokens from start to stop, i.e. their joined token
+        strings."""
+        stop = min(stop, len(self.ids))
+        if stop <= start:
+            return ""
+        begin = self.ends[start - 1] if start > 0 else 0
+        return self.text[begin : self.ends[stop - 1]]
+
+
+def count_tokens(tokenization: Tokenization) -> int:
+    """Sizes a cached tokenization by its number of tokens."""
+    return len(tokenization.ids)
+
+
+class EmbeddingMatrix:
+    """Accumulates embeddings as the rows of a contiguous float32 matrix, which takes a fraction
+    of the memory of lists of Python floats. The capacity doubles whenever the matrix is full."""
+
+    def __init__(self, initial_capacity: int = 1024):
+        self.initial_capacity = initial_capacity
+        self.values = None
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def append(self, embeddings: List[List[float]]) -> range:
+        """Appends embeddings as new rows of the matrix.
+
+        Args:
+            embeddings (List[List[float]]): The embeddings to append, all of the same dimension.
+
+        Returns:
+            range: The indices of the rows holding the appended embeddings.
+        """
+        if not len(embeddings):
+            return range(self.size, self.size)
+
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        required_size = self.size + len(embeddings)
+        if self.values is None:
+            self.values = np.empty(
+                (max(self.initial_capacity, required_size), embeddings.shape[1]), dtype=np.float32
+            )
+        elif required_size > len(self.values):
+            capacity = len(self.values)
+            while capacity < required_size:
+                capacity *= 2
+            grown_values = np.empty((capacity, self.values.shape[1]), dtype=np.float32)
+            grown_values[: self.size] = self.values[: self.size]
+            self.values = grown_values
+
+        self.values[self.size : required_size] = embeddings
+        rows = range(self.size, required_size)
+        self.size = required_size
+        return rows
+
+    def take(self, rows: List[int]) -> np.ndarray:
+        """Gathers the given rows into a new, trimmed matrix.
+
+        Args:
+            rows (List[int]): The indices of the rows to gather, in the desired order.
+
+        Returns:
+            np.ndarray: A float32 matrix holding the given rows.
+        """
+        if self.values is None:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.take(self.values[: self.size], rows, axis=0)
+
+
+def create_cohere_async_client(
+    cohere_api_key: str, max_connections: int = 32
+) -> httpx.AsyncClient:
+    """Creates an asynchronous HTTP/2 client authorized to use the Cohere API. Concurrent requests
+    are multiplexed over shared connections, avoiding a TLS handshake per request. Responses are
+    requested compressed, since embeddings serialized as JSON are large.
+
+    Args:
+        cohere_api_key (str): The API key for accessing Cohere's services.
+        max_connections (int): The maximum number of open connections. Defaults to 32.
+
+    Returns:
+        httpx.AsyncClient: The configured client.
+    """
+    return httpx.AsyncClient(
+        http2=True,
+        headers={
+            "Authorization": f"Bearer {cohere_api_key}",
+            "Content-Type": "application/json",
+            "Accept-Encoding": "gzip, deflate",
+        },
+        limits=httpx.Limits(
+            max_connections=max_connections, max_keepalive_connections=max_connections
+        ),
+        timeout=60,
+    )
+
+
+def create_cohere_session(cohere_api_key: str, pool_size: int = 10) -> requests.Session:
+    """Creates a session authorized to use the Cohere API. Requests that fail with a rate limit or
+    a server error are retried with exponential backoff, honoring the Retry-After header. Embed
+    requests are left out, as CohereTextProcessingService.get_embeddings retries them itself.
+    Responses are requested compressed.
+
+    Args:
+        cohere_api_key (str): The API key for accessing Cohere's services.
+        pool_size (int): The number of connections kept alive. Should fit all concurrent requests.
+        Defaults to 10.
+
+    Returns:
+        requests.Session: The configured session.
+    """
+    session = requests.Session()
+    session.headers.update(
+        {
+            "Authorization": f"Bearer {cohere_api_key}",
+            "Content-Type": "application/json",
+            "Accept-Encoding": "gzip, deflate",
+        }
+    )
+    retries = Retry(
+        total=5,
+        backoff_factor=1.5,
+        status_forcelist=RETRYABLE_STATUS_CODES,
+        allowed_methods=["POST"],
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries)
+    session.mount("https://", adapter)
+    # Retrying embed requests here too would multiply the attempts of both retry layers
+    embed_adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+    session.mount(EMBED_URL, embed_adapter)
+    return session
+
 
 class TextProcessingService(ABC):
     @abstractmethod
@@ -54,8 +416,18 @@ class TextProcessingService(ABC):
         pass
 
     @abstractmethod
-    def get_embedding(self, tokens: List[str]) -> List[List[float]]:
-        """Retrieves embeddings for the given text."""
+    def get_tokenization(self, text: str) -> Tokenization:
+        """Tokenizes the given text into a compact Tokenization."""
+        pass
+
+    @abstractmethod
+    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Retrieves embeddings for the given texts, preserving their order."""
+        pass
+
+    @abstractmethod
+    async def aget_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Asynchronously retrieves embeddings for the given texts, preserving their order."""
         pass
 
     @abstractmethod
@@ -70,11 +442,30 @@ class CohereTextProcessingService(TextProcessingService):
         session: requests.Session,
         model_name: str = "embed-multilingual-v2.0",
         embedding_type: str = "search_document",
+        local_tokenizer_name: str = None,
+        async_client: httpx.AsyncClient = None,
+        max_cached_tokens: int = 1_000_000,
+        max_leading_paragraphs_length: int = 4096,
+        compress_requests: bool = False,
     ):
 
         self.session = session
+        self.async_client = async_client
         self.model_name = model_name
         self.embedding_type = embedding_type
+        # If a local tokenizer is given, texts are tokenized without requests to the Cohere API
+        self.local_tokenizer_name = local_tokenizer_name
+        self.local_tokenizer = (
+            Tokenizer.from_pretrained(local_tokenizer_name) if local_tokenizer_name else None
+        )
+        # Scraped pages often repeat the same texts, so tokenizations are cached by exact text.
+        # Pages also share boilerplate (e.g. navigation), so their leading paragraphs are cached
+        # as well. Both caches are bounded by the total number of tokens they hold.
+        self.tokenization_cache = LRUCache(max_cached_tokens, sizeof=count_tokens)
+        self.paragraph_cache = LRUCache(max_cached_tokens, sizeof=count_tokens)
+        self.max_leading_paragraphs_length = max_leading_paragraphs_length
+        # Whether request bodies of texts are sent gzip-compressed
+        self.compress_requests = compress_requests
 
     # TODO: Consider whether to use a context manager from within the class
     #     @contextmanager
@@ -83,8 +474,8 @@ class CohereTextProcessingService(TextProcessingService):
     #         yield session
 
     def tokenize_text(self, text: str, model_name: str = None) -> List[int]:
-        """Tokenizes a text using the Cohere API. Implemented for precise control over token-wise
-        text chunking to optimize embeddings quality.
+        """Tokenizes a text using the local tokenizer or the Cohere API. Implemented for precise
+        control over token-wise text chunking to optimize embeddings quality.
 
         Args:
             text (str): The text to tokenize.
@@ -95,28 +486,142 @@ class CohereTextProcessingService(TextProcessingService):
             List[int]: A list of tokens.
 
         Raises:
-            ValueError: If the text length exceeds the maximum limit.
+            Exception: If there is an error in the tokenization process.
+        """
+        return self.get_tokenization(text, model_name=model_name).ids.tolist()
+
+    def get_tokenization(self, text: str, model_name: str = None) -> Tokenization:
+        """Tokenizes a text using the local tokenizer if available, or the Cohere API otherwise,
+        returning a compact Tokenization. Results are cached by the exact text. Callers must not
+        modify the returned tokenization, as it may be shared through the cache.
+
+        Args:
+            text (str): The text to tokenize.
+            model_name (str, optional): The model name compatible with the tokenizer. If None,
+            uses the model set during class instantiation.
+
+        Returns:
+            Tokenization: The token ids and the text they cover, with the offsets of the tokens.
+
+        Raises:
+            Exception: If there is an error in the tokenization process.
+        """
+        selected_model = model_name if model_name else self.model_name
+        fingerprint = self.tokenizer_fingerprint(selected_model)
+        tokenization = self.tokenization_cache.get((fingerprint, text))
+        if tokenization is None:
+            tokenization = self.tokenize_text_uncached(text, selected_model, fingerprint)
+            self.tokenization_cache.put((fingerprint, text), tokenization)
+        return tokenization
+
+    def tokenizer_fingerprint(self, model_name: str) -> TokenizerFingerprint:
+        """Identifies the tokenizer used for the given model.
+
+        Args:
+            model_name (str): The model name compatible with the tokenizer.
+
+        Returns:
+            TokenizerFingerprint: The local tokenizer if available, or the Cohere API otherwise.
+        """
+        if self.local_tokenizer is not None:
+            return TokenizerFingerprint(self.local_tokenizer_name, "local")
+        return TokenizerFingerprint(model_name, COHERE_API_VERSION)
+
+    def tokenize_text_uncached(
+        self, text: str, model_name: str, fingerprint: TokenizerFingerprint
+    ) -> Tokenization:
+        """Tokenizes a text with the local tokenizer if available, or the Cohere API otherwise.
+
+        With the local tokenizer, each paragraph in the leading max_leading_paragraphs_length
+        characters is tokenized on its own and cached, so boilerplate shared by the beginnings of
+        pages (e.g. navigation) is tokenized once. Tokens at the paragraph breaks may differ
+        marginally from those of tokenizing the whole text at once, but the result depends only on
+        the text, never on what happens to be cached, so repeated runs produce the same chunks.
+        With the Cohere API, texts are not split, as every paragraph would cost a request.
+
+        Args:
+            text (str): The text to tokenize.
+            model_name (str): The model name compatible with the tokenizer.
+            fingerprint (TokenizerFingerprint): The tokenizer the cached paragraphs belong to.
+
+        Returns:
+            Tokenization: The token ids and the text they cover, with the offsets of the tokens.
+        """
+        if self.local_tokenizer is None:
+            return self.tokenize_text_remotely(text, model_name)
+
+        head = text[: self.max_leading_paragraphs_length]
+        tokenizations = []
+        start = 0
+        position = head.find(PARAGRAPH_SEPARATOR)
+        while position != -1:
+            end = position + len(PARAGRAPH_SEPARATOR)
+            paragraph_tokenization = self.paragraph_cache.get((fingerprint, text[start:end]))
+            if paragraph_tokenization is None:
+                paragraph_tokenization = self.tokenize_text_locally(text[start:end])
+                self.paragraph_cache.put((fingerprint, text[start:end]), paragraph_tokenization)
+            tokenizations.append(paragraph_tokenization)
+            start = end
+            position = head.find(PARAGRAPH_SEPARATOR, start)
+
+        if not tokenizations:
+            return self.tokenize_text_locally(text)
+        if start < len(text):
+            tokenizations.append(self.tokenize_text_locally(text[start:]))
+        return Tokenization.concatenate(tokenizations, text)
+
+    def tokenize_text_locally(self, text: str) -> Tokenization:
+        """Tokenizes a text with the local tokenizer. Token strings span the text using the token
+        offsets, so joining all of them gives back the original text.
+
+        Args:
+            text (str): The text to tokenize.
+
+        Returns:
+            Tokenization: The token ids and the text they cover, with the offsets of the tokens.
+        """
+        encoding = self.local_tokenizer.encode(text, add_special_tokens=False)
+        # Each token string spans from its token's start to the next token's start, so the text
+        # between tokens (e.g. whitespace) is kept as well
+        ends = array("i", [start for start, _ in encoding.offsets[1:]])
+        if encoding.ids:
+            ends.append(len(text))
+        return Tokenization(array("i", encoding.ids), text, ends)
+
+    def tokenize_text_remotely(self, text: str, model_name: str) -> Tokenization:
+        """Tokenizes a text using the Cohere API.
+
+        Args:
+            text (str): The text to tokenize.
+            model_name (str): The model name compatible with the tokenizer.
+
+        Returns:
+            Tokenization: The token ids and the text they cover, with the offsets of the tokens.
+
+        Raises:
             Exception: If there is an error in the tokenization process.
         TODO: gracefully continue if the text length exceeds the maximum limit. Just log an error,
               inform about truncating, and continue.
         """
-        max_length = 65536
-        if len(text) > max_length:
+        if len(text) > MAX_TOKENIZE_TEXT_LENGTH:
             logging.warning(
-                f"Text length exceeds the maximum limit of {max_length} characters. "
+                f"Text length exceeds the maximum limit of {MAX_TOKENIZE_TEXT_LENGTH} characters. "
                 "The cohere API doesn't handle more during tokenization. "
-                "Text was therefore truncated to 65534 characters to meet the limit."
+                f"Text was therefore truncated to {MAX_TOKENIZE_TEXT_LENGTH} characters to meet "
+                "the limit."
             )
-            text = text[0:max_length]
-
-        selected_model = model_name if model_name else self.model_name
+            text = text[0:MAX_TOKENIZE_TEXT_LENGTH]
 
         url = "https://api.cohere.ai/v1/tokenize"
-        data = {"text": text, "model": selected_model}
-        response = self.session.post(url, json=data)
+        data = {"text": text, "model": model_name}
+        body, headers = self.encode_request_body(data)
+        response = self.session.post(url, data=body, headers=headers)
 
         if response.status_code == 200:
-            return response.json().get("tokens", [])
+            response_json = orjson.loads(response.content)
+            return Tokenization.from_token_strings(
+                response_json.get("tokens", []), response_json.get("token_strings", [])
+            )
         else:
             raise Exception(f"Error tokenizing text: {response.text}")
 
@@ -139,20 +644,87 @@ class CohereTextProcessingService(TextProcessingService):
         url = "https://api.cohere.ai/v1/detokenize"
         selected_model = model_name if model_name else self.model_name
         data = {"tokens": tokens, "model": selected_model}
-        response = self.session.post(url, json=data)
+        response = self.session.post(url, data=orjson.dumps(data))
 
         if response.status_code == 200:
-            return response.json().get("text", "")
+            return orjson.loads(response.content).get("text", "")
         else:
             raise Exception(f"Error detokenizing text: {response.text}")
 
-    def get_embedding(
-        self, text: str, model_name: str = None, embedding_type: str = None
-    ) -> List[float]:
-        """Retrieves embedding for the text using the Cohere API.
+    def encode_request_body(self, data: dict) -> Tuple[bytes, Dict[str, str]]:
+        """Serializes the payload of a request, compressing it with gzip if request compression is
+        enabled and the payload is large enough to benefit from it.
 
         Args:
-            tokens (str): A string to embed.
+            data (dict): The payload of the request.
+
+        Returns:
+            Tuple[bytes, Dict[str, str]]: The body of the request and the headers describing it.
+        """
+        body = orjson.dumps(data)
+        if self.compress_requests and len(body) >= MIN_COMPRESSED_REQUEST_SIZE:
+            return gzip.compress(body, compresslevel=6), {"Content-Encoding": "gzip"}
+        return body, {}
+
+    def build_embed_request(
+        self, texts: List[str], model_name: str = None, embedding_type: str = None
+    ) -> dict:
+        """Builds the payload of a request to the Cohere embed endpoint.
+
+        Raises:
+            ValueError: If more texts are passed than the API accepts in a single request.
+        """
+        if len(texts) > MAX_TEXTS_PER_EMBED_REQUEST:
+            raise ValueError(
+                f"Cannot embed {len(texts)} texts in a single request. "
+                f"The Cohere API accepts at most {MAX_TEXTS_PER_EMBED_REQUEST} texts."
+            )
+
+        selected_model = model_name if model_name else self.model_name
+        input_type = embedding_type if embedding_type else self.embedding_type
+        return {
+            "texts": texts,
+            "model": selected_model,
+            "input_type": input_type,
+        }
+
+    @staticmethod
+    def parse_embed_response(response, expected_count: int) -> List[List[float]]:
+        """Extracts the embeddings from a response of the Cohere embed endpoint. Works with both
+        requests and httpx responses.
+
+        Raises:
+            CohereAPIError: If the request failed.
+            Exception: If the request returned an unexpected number of embeddings.
+        """
+        if response.status_code == 200:
+            embeddings = orjson.loads(response.content).get("embeddings", [])
+        else:
+            raise CohereAPIError(
+                f"Error getting embeddings: {response.text}",
+                status_code=response.status_code,
+                retry_after=parse_retry_after(response.headers.get("Retry-After")),
+            )
+
+        if len(embeddings) != expected_count:
+            raise Exception(
+                f"Error getting embeddings: expected {expected_count} embeddings, "
+                f"got {len(embeddings)}"
+            )
+        return embeddings
+
+    @retry_embed_request
+    def get_embeddings(
+        self, texts: List[str], model_name: str = None, embedding_type: str = None
+    ) -> List[List[float]]:
+        """Retrieves embeddings for a batch of texts in a single request to the Cohere API.
+        Requests failing with a rate limit, a server error or a connection error are retried for
+        up to MAX_RETRY_TIME seconds, waiting as long as the Retry-After header requests (at most
+        MAX_RETRY_WAIT seconds), or with exponential backoff otherwise.
+
+        Args:
+            texts (List[str]): The strings to embed. At most MAX_TEXTS_PER_EMBED_REQUEST texts
+            can be sent in a single request.
             model_name (str, optional): The model name compatible with the detokenizer. If None,
             uses the model set during class instantiation. Defaults to None.
             embedding_type (str): Specifies the type of the embeddings. Defaults to None.
@@ -163,37 +735,181 @@ class CohereTextProcessingService(TextProcessingService):
             -'clustering'.
 
         Returns:
-            List[float]: A list of embeddings.
+            List[List[float]]: A list of embeddings, in the same order as the input texts.
 
         Raises:
+            ValueError: If more texts are passed than the API accepts in a single request.
             Exception: If there is an error in retrieving embeddings.
         """
-        url = "https://api.cohere.ai/v1/embed"
-        selected_model = model_name if model_name else self.model_name
-        input_type = embedding_type if embedding_type else self.embedding_type
-        data = {
-            "texts": [text],
-            "model": selected_model,
-            "input_type": input_type,
-        }
-        response = self.session.post(url, json=data)
-        if response.status_code == 200:
-            embedding = response.json().get("embeddings", [])[0]
-        else:
-            raise Exception(f"Error getting embeddings: {response.text}")
-        return embedding
+        url = EMBED_URL
+        data = self.build_embed_request(texts, model_name, embedding_type)
+        body, headers = self.encode_request_body(data)
+        response = self.session.post(url, data=body, headers=headers)
+        return self.parse_embed_response(response, len(texts))
+
+    @retry_embed_request
+    async def aget_embeddings(
+        self, texts: List[str], model_name: str = None, embedding_type: str = None
+    ) -> List[List[float]]:
+        """Asynchronous counterpart of get_embeddings, sending the request with the HTTP/2 async
+        client so that many batches can be in flight over the same connection.
+
+        Raises:
+            ValueError: If no async client was provided or too many texts are passed.
+            Exception: If there is an error in retrieving embeddings.
+        """
+        if self.async_client is None:
+            raise ValueError("An async client is required to embed texts asynchronously.")
+
+        url = EMBED_URL
+        data = self.build_embed_request(texts, model_name, embedding_type)
+        body, headers = self.encode_request_body(data)
+        response = await self.async_client.post(url, content=body, headers=headers)
+        return self.parse_embed_response(response, len(texts))
+
+
+class CachedCohereService(TextProcessingService):
+    """Wraps a CohereTextProcessingService with a persistent, content-addressed cache of
+    embeddings stored in an SQLite database. Only texts missing from the cache are sent to the
+    embedding API, so re-running the pipeline on partially updated data is cheap.
+
+    Cache keys are BLAKE2b digests of the model name, the embedding type and the text, so
+    embeddings of different models never collide. Embeddings are stored as raw little-endian
+    float32 bytes.
+    """
+
+    def __init__(self, service: CohereTextProcessingService, cache_file_path: str):
+        self.service = service
+        self.cache_file_path = cache_file_path
+
+        cache_dir = os.path.dirname(cache_file_path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        with closing(sqlite3.connect(cache_file_path)) as connection, connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, embedding BLOB)"
+            )
+
+    def tokenize_text(self, text: str, model_name: str = None) -> List[int]:
+        return self.service.tokenize_text(text, model_name=model_name)
+
+    def get_tokenization(self, text: str, model_name: str = None) -> Tokenization:
+        return self.service.get_tokenization(text, model_name=model_name)
+
+    def detokenize_text(self, tokens: List[int], model_name: str = None) -> str:
+        return self.service.detokenize_text(tokens, model_name=model_name)
+
+    def get_embeddings(
+        self, texts: List[str], model_name: str = None, embedding_type: str = None
+    ) -> List[List[float]]:
+        return self.get_or_compute_many(
+            texts, model_name=model_name, embedding_type=embedding_type
+        )
+
+    async def aget_embeddings(
+        self, texts: List[str], model_name: str = None, embedding_type: str = None
+    ) -> List[List[float]]:
+        return await self.aget_or_compute_many(
+            texts, model_name=model_name, embedding_type=embedding_type
+        )
+
+    @staticmethod
+    def cache_key(text: str, model_name: str, embedding_type: str) -> bytes:
+        """Computes the content-addressed cache key of a text, namespaced by the model name and
+        the embedding type."""
+        key_material = f"{model_name}\0{embedding_type}\0{text}".encode("utf-8")
+        return hashlib.blake2b(key_material, digest_size=32).digest()
+
+    def lookup(self, keys: List[bytes]) -> Dict[bytes, List[float]]:
+        """Retrieves the cached embeddings of the given keys. Missing keys are left out."""
+        with closing(sqlite3.connect(self.cache_file_path)) as connection:
+            placeholders = ", ".join("?" * len(keys))
+            rows = connection.execute(
+                f"SELECT key, embedding FROM embeddings WHERE key IN ({placeholders})", keys
+            ).fetchall()
+        return {key: np.frombuffer(embedding, dtype="<f4").tolist() for key, embedding in rows}
+
+    def store(self, keys: List[bytes], embeddings: List[List[float]]) -> Dict[bytes, List[float]]:
+        """Caches the embeddings under the given keys and returns them keyed by the cache keys."""
+        with closing(sqlite3.connect(self.cache_file_path)) as connection, connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, embedding) VALUES (?, ?)",
+                [
+                    (key, np.asarray(embedding, dtype="<f4").tobytes())
+                    for key, embedding in zip(keys, embeddings)
+                ],
+            )
+        return dict(zip(keys, embeddings))
+
+    def get_or_compute_many(
+        self, texts: List[str], model_name: str = None, embedding_type: str = None
+    ) -> List[List[float]]:
+        """Retrieves embeddings for the texts from the cache, computing and caching the missing
+        ones with the wrapped service.
 
+        Args:
+            texts (List[str]): The strings to embed.
+            model_name (str, optional): The model name. If None, uses the model of the wrapped
+            service.
+            embedding_type (str, optional): The type of the embeddings. If None, uses the
+            embedding type of the wrapped service.
+
+        Returns:
+            List[List[float]]: A list of embeddings, in the same order as the input texts.
+        """
+        selected_model = model_name if model_name else self.service.model_name
+        input_type = embedding_type if embedding_type else self.service.embedding_type
+        keys = [self.cache_key(text, selected_model, input_type) for text in texts]
+
+        cached = self.lookup(keys)
+        missing_indices = [i for i, key in enumerate(keys) if key not in cached]
+        if missing_indices:
+            computed = self.service.get_embeddings(
+                [texts[i] for i in missing_indices],
+                model_name=selected_model,
+                embedding_type=input_type,
+            )
+            cached.update(self.store([keys[i] for i in missing_indices], computed))
+
+        logging.debug(f"Embedding cache hits: {len(texts) - len(missing_indices)}/{len(texts)}")
+        return [cached[key] for key in keys]
+
+    async def aget_or_compute_many(
+        self, texts: List[str], model_name: str = None, embedding_type: str = None
+    ) -> List[List[float]]:
+        """Asynchronous counterpart of get_or_compute_many. The cache is read and written in a
+        worker thread, so that SQLite doesn't block the other requests on the event loop."""
+        selected_model = model_name if model_name else self.service.model_name
+        input_type = embedding_type if embedding_type else self.service.embedding_type
+        keys = [self.cache_key(text, selected_model, input_type) for text in texts]
 
-def chunk_tokens(tokens: List[int], max_size: int, min_size: int) -> List[List[int]]:
-    """Splits a list of tokens into chunks with specified maximum and minimum sizes.
+        cached = await asyncio.to_thread(self.lookup, keys)
+        missing_indices = [i for i, key in enumerate(keys) if key not in cached]
+        if missing_indices:
+            computed = await self.service.aget_embeddings(
+                [texts[i] for i in missing_indices],
+                model_name=selected_model,
+                embedding_type=input_type,
+            )
+            cached.update(
+                await asyncio.to_thread(self.store, [keys[i] for i in missing_indices], computed)
+            )
+
+        logging.debug(f"Embedding cache hits: {len(texts) - len(missing_indices)}/{len(texts)}")
+        return [cached[key] for key in keys]
+
+
+def chunk_tokens(tokens: Sequence[int], max_size: int, min_size: int) -> List[Sequence[int]]:
+    """Splits a sequence of tokens into chunks with specified maximum and minimum sizes.
 
     Args:
-        tokens (List[int]): The list of tokens to be chunked.
+        tokens (Sequence[int]): The tokens to be chunked, e.g. a list or an array.
         max_size (int): The maximum size of each chunk.
         min_size (int): The minimum size for the last chunk.
 
     Returns:
-        List[List[int]]: A list of token chunks that meet the size constraints.
+        List[Sequence[int]]: A list of token chunks, of the same type as the tokens, that meet the
+        size constraints.
     """
     chunks = [tokens[i : i + max_size] for i in range(0, len(tokens), max_size)]
 
@@ -206,101 +922,460 @@ def chunk_tokens(tokens: List[int], max_size: int, min_size: int) -> List[List[i
     return chunks
 
 
-def embed_file_contents(
-    json_data: dict,
+async def embed_pending_records(
+    pending_records: List[dict],
+    text_processor: TextProcessingService,
+    embedding_matrix: EmbeddingMatrix,
+) -> range:
+    """Embeds the detokenized chunks of the pending records with a single batched request and
+    appends the resulting embeddings to the embedding matrix in order.
+
+    Args:
+        pending_records (List[dict]): Processed records awaiting their embeddings. Each record
+        must contain the 'detokenized_chunk' key.
+        text_processor (TextProcessingService): The text processing service to use.
+        embedding_matrix (EmbeddingMatrix): The matrix accumulating the embeddings.
+
+    Returns:
+        range: The rows of the embedding matrix holding the embeddings of the pending records, or
+        an empty range if the batch could not be embedded.
+    """
+    if not pending_records:
+        return range(0)
+
+    try:
+        embeddings = await text_processor.aget_embeddings(
+            [record["detokenized_chunk"] for record in pending_records]
+        )
+    except Exception as e:
+        logging.error(f"Error embedding a batch of {len(pending_records)} chunks: {e}")
+        return range(0)
+
+    if len(embeddings) != len(pending_records):
+        logging.error(
+            f"Expected {len(pending_records)} embeddings for a batch, got {len(embeddings)}"
+        )
+        return range(0)
+    return embedding_matrix.append(embeddings)
+
+
+def split_record_into_chunks(
+    record_id: int,
+    record: dict,
     text_processor: TextProcessingService,
     max_embedding_model_input_length: int = 512,
     minimum_chunk_length_in_tokens: int = 10,
-) -> List[dict]:
-    """Processes a single file by tokenizing, detokenizing, and obtaining embeddings for the text.
+) -> List[ChainMap]:
+    """Tokenizes the text of a record and splits it into processed records, one per token chunk.
+    The text of each chunk is reconstructed locally from the token strings. The processed records
+    don't have embeddings yet.
 
     Args:
-        json_data (dict): A file to process.
+        record_id (int): The position of the record in the input stream.
+        record (dict): The record to process.
         text_processor (TextProcessingService): The text processing service to use.
         max_embedding_model_input_length (int): Maximum length of the input to the embedding model
         in tokens.
-        min_size (int): The minimum size for the last chunk. Defaults to 10.
+        minimum_chunk_length_in_tokens (int): The minimum size for the last chunk. Defaults to 10.
 
     Returns:
-        List[dict]: A list of processed data records.
+        List[ChainMap]: The processed records awaiting their embeddings. Their chunk-specific keys
+        are layered over the original record, which is shared by all chunks of the record.
     """
+    text = record.get("text", "")
+    if not text:
+        return []
 
-    processed_data = []
-    for i, record in tqdm(enumerate(json_data), desc="Processing records", total=len(json_data)):
-        text = record.get("text", "")
-        if text:
-            try:
-                tokens = text_processor.tokenize_text(text)
-                token_chunks = chunk_tokens(
-                    tokens,
-                    max_size=max_embedding_model_input_length,
-                    min_size=minimum_chunk_length_in_tokens,
-                )
-                for k, chunk in tqdm(
-                    enumerate(token_chunks), desc="Processing token chunks", leave=False
-                ):
-                    detokenized_chunk = text_processor.detokenize_text(chunk)
-                    embedding = text_processor.get_embedding(detokenized_chunk)
-                    processed_record = {
-                        **record,  # Include original record data
+    try:
+        # The tokenization stores its ids as an array of 4-byte ints, so the chunks sliced from it
+        # are arrays as well, a fraction of the size of lists of ints
+        tokenization = text_processor.get_tokenization(text)
+        token_chunks = chunk_tokens(
+            tokenization.ids,
+            max_size=max_embedding_model_input_length,
+            min_size=minimum_chunk_length_in_tokens,
+        )
+        chunk_records = []
+        for k, chunk in enumerate(token_chunks):
+            start = k * max_embedding_model_input_length
+            detokenized_chunk = tokenization.join_token_strings(start, start + len(chunk))
+            # The original record data is shared by all of its chunks rather than copied
+            chunk_records.append(
+                ChainMap(
+                    {
+                        "record_id": record_id,
+                        "chunk_index": k,
                         "tokenized_chunk": chunk,
                         "detokenized_chunk": detokenized_chunk,
-                        "embedding": embedding,
-                        "embedding_id": f"{i}_{k}",
-                    }
-                    processed_data.append(processed_record)
-            except Exception as e:
-                logging.error(f"Error processing text: {e}")
+                        "embedding_id": f"{record_id}_{k}",
+                    },
+                    record,
+                )
+            )
+        return chunk_records
+    except Exception as e:
+        logging.error(f"Error processing text: {e}")
+        return []
+
+
+def pack_chunk_records(
+    window: List[Tuple[Any, dict]], batch_size: int, max_tokens_per_batch: int
+) -> Iterator[List[Tuple[Any, dict]]]:
+    """Sorts a window of processed records by their length in tokens and greedily packs them into
+    batches, so that each batch holds chunks of similar length.
+
+    Args:
+        window (List[Tuple[Any, dict]]): Processed records paired with their positions in the
+        input stream.
+        batch_size (int): The maximum number of records in a batch.
+        max_tokens_per_batch (int): The maximum total number of tokens in a batch. A single record
+        longer than the limit is still embedded in a batch of its own.
+
+    Yields:
+        List[Tuple[Any, dict]]: A batch of processed records paired with their positions.
+    """
+    batch = []
+    batch_tokens = 0
+    for position, record in sorted(window, key=lambda item: len(item[1]["tokenized_chunk"])):
+        record_tokens = len(record["tokenized_chunk"])
+        if batch and (
+            len(batch) == batch_size or batch_tokens + record_tokens > max_tokens_per_batch
+        ):
+            yield batch
+            batch = []
+            batch_tokens = 0
+        batch.append((position, record))
+        batch_tokens += record_tokens
+    if batch:
+        yield batch
+
+
+async def produce_records(
+    json_data: Iterable[dict], record_queue: asyncio.Queue, consumer_count: int
+) -> None:
+    """First stage of the embedding pipeline. Streams the records into the record queue, paired
+    with their positions in the input stream.
+
+    Args:
+        json_data (Iterable[dict]): The records of a file to process. Can be a lazy iterator.
+        record_queue (asyncio.Queue): The queue of records to tokenize.
+        consumer_count (int): The number of tasks consuming the record queue, each of which
+        receives an END_OF_STREAM marker once all records are queued.
+    """
+    total = len(json_data) if isinstance(json_data, Sized) else None
+    try:
+        for i, record in tqdm(enumerate(json_data), desc="Processing records", total=total):
+            await record_queue.put((i, record))
+    finally:
+        for _ in range(consumer_count):
+            await record_queue.put(END_OF_STREAM)
+
+
+async def tokenize_records(
+    record_queue: asyncio.Queue,
+    chunk_queue: asyncio.Queue,
+    text_processor: TextProcessingService,
+    max_embedding_model_input_length: int = 512,
+    minimum_chunk_length_in_tokens: int = 10,
+) -> None:
+    """Second stage of the embedding pipeline. Splits records from the record queue into processed
+    records, one per token chunk, and puts them into the chunk queue. Tokenization runs in a
+    worker thread, so the event loop keeps sending embedding requests meanwhile.
+
+    Args:
+        record_queue (asyncio.Queue): The queue of records to tokenize.
+        chunk_queue (asyncio.Queue): The queue of processed records, paired with their
+        (record_id, chunk_index) positions.
+        text_processor (TextProcessingService): The text processing service to use.
+        max_embedding_model_input_length (int): Maximum length of the input to the embedding model
+        in tokens.
+        minimum_chunk_length_in_tokens (int): The minimum size for the last chunk. Defaults to 10.
+    """
+    try:
+        while (item := await record_queue.get()) is not END_OF_STREAM:
+            record_id, record = item
+            chunk_records = await asyncio.to_thread(
+                split_record_into_chunks,
+                record_id,
+                record,
+                text_processor,
+                max_embedding_model_input_length,
+                minimum_chunk_length_in_tokens,
+            )
+            for chunk_record in chunk_records:
+                await chunk_queue.put(((record_id, chunk_record["chunk_index"]), chunk_record))
+    finally:
+        await chunk_queue.put(END_OF_STREAM)
+
+
+async def batch_chunk_records(
+    chunk_queue: asyncio.Queue,
+    batch_queue: asyncio.Queue,
+    batch_size: int,
+    max_tokens_per_batch: int,
+    producer_count: int = 1,
+    consumer_count: int = 1,
+    window_size_in_batches: int = 4,
+) -> None:
+    """Groups processed records from the chunk queue into batches limited both by the number of
+    records and by the total number of tokens. Records are collected into windows worth
+    window_size_in_batches batches, which are then packed by length with pack_chunk_records.
+
+    Args:
+        chunk_queue (asyncio.Queue): The queue of processed records paired with their positions.
+        batch_queue (asyncio.Queue): The queue of batches to embed. Each batch is a list of
+        processed records paired with their positions, which allows restoring the original order.
+        batch_size (int): The maximum number of records in a batch.
+        max_tokens_per_batch (int): The maximum total number of tokens in a batch.
+        producer_count (int): The number of tasks filling the chunk queue. Batching ends once
+        each of them has sent an END_OF_STREAM marker. Defaults to 1.
+        consumer_count (int): The number of tasks consuming the batch queue. Defaults to 1.
+        window_size_in_batches (int): The number of batches worth of records sorted together.
+        Defaults to 4.
+    """
+    window = []
+    window_tokens = 0
+    finished_producers = 0
+    try:
+        while finished_producers < producer_count:
+            item = await chunk_queue.get()
+            if item is END_OF_STREAM:
+                finished_producers += 1
+                continue
+            window.append(item)
+            window_tokens += len(item[1]["tokenized_chunk"])
+            if (
+                len(window) >= window_size_in_batches * batch_size
+                or window_tokens >= window_size_in_batches * max_tokens_per_batch
+            ):
+                for batch in pack_chunk_records(window, batch_size, max_tokens_per_batch):
+                    await batch_queue.put(batch)
+                window = []
+                window_tokens = 0
+        for batch in pack_chunk_records(window, batch_size, max_tokens_per_batch):
+            await batch_queue.put(batch)
+    finally:
+        for _ in range(consumer_count):
+            await batch_queue.put(END_OF_STREAM)
+
+
+async def embed_batches(
+    batch_queue: asyncio.Queue,
+    result_queue: asyncio.Queue,
+    text_processor: TextProcessingService,
+    embedding_matrix: EmbeddingMatrix,
+    stagger: bool = False,
+) -> None:
+    """Third stage of the embedding pipeline. Embeds batches from the batch queue one request at
+    a time and puts each batch, with the rows of its embeddings, into the result queue.
+
+    Args:
+        batch_queue (asyncio.Queue): The queue of batches to embed.
+        result_queue (asyncio.Queue): The queue of embedded batches.
+        text_processor (TextProcessingService): The text processing service to use.
+        embedding_matrix (EmbeddingMatrix): The matrix accumulating the embeddings.
+        stagger (bool): If True, waits a random 50-200 ms before sending the first request, so
+        that the first wave of requests doesn't hit the API at the same instant. Defaults to
+        False.
+    """
+    try:
+        while (batch := await batch_queue.get()) is not END_OF_STREAM:
+            if stagger:
+                await asyncio.sleep(random.uniform(0.05, 0.2))
+                stagger = False
+            rows = await embed_pending_records(
+                [record for _, record in batch], text_processor, embedding_matrix
+            )
+            await result_queue.put((batch, rows))
+    finally:
+        await result_queue.put(END_OF_STREAM)
+
+
+async def collect_embedded_records(
+    result_queue: asyncio.Queue, producer_count: int = 1
+) -> List[Tuple[Any, dict, int]]:
+    """Last stage of the embedding pipeline. Drains the result queue, pairing each processed
+    record with the row of its embedding. Records of batches that failed to embed are skipped.
+
+    Args:
+        result_queue (asyncio.Queue): The queue of embedded batches.
+        producer_count (int): The number of tasks filling the result queue. Defaults to 1.
+
+    Returns:
+        List[Tuple[Any, dict, int]]: The embedded records with their positions and rows, in the
+        order of completion.
+    """
+    embedded_records = []
+    finished_producers = 0
+    while finished_producers < producer_count:
+        item = await result_queue.get()
+        if item is END_OF_STREAM:
+            finished_producers += 1
+            continue
+        batch, rows = item
+        embedded_records.extend(
+            (position, record, row) for (position, record), row in zip(batch, rows)
+        )
+    return embedded_records
 
+
+async def embed_file_contents(
+    json_data: Iterable[dict],
+    text_processor: TextProcessingService,
+    max_embedding_model_input_length: int = 512,
+    minimum_chunk_length_in_tokens: int = 10,
+    batch_size: int = MAX_TEXTS_PER_EMBED_REQUEST,
+    max_tokens_per_batch: int = 40_000,
+    max_inflight: int = 8,
+    tokenizer_count: int = 4,
+) -> List[dict]:
+    """Processes a single file by tokenizing and obtaining embeddings for the text.
+    Reading, tokenization and embedding run as concurrent stages of a pipeline connected by
+    bounded queues, so records are tokenized while earlier chunks are being embedded. Chunks are
+    accumulated across records and embedded in batches of similar-length chunks, with up to
+    max_inflight batches being embedded concurrently. Embeddings are accumulated in a single
+    float32 matrix, and each record refers to its row with the 'embedding_row' key.
+
+    Args:
+        json_data (Iterable[dict]): The records of a file to process. Can be a lazy iterator.
+        text_processor (TextProcessingService): The text processing service to use.
+        max_embedding_model_input_length (int): Maximum length of the input to the embedding model
+        in tokens.
+        min_size (int): The minimum size for the last chunk. Defaults to 10.
+        batch_size (int): The maximum number of chunks embedded with a single request. Capped at
+        MAX_TEXTS_PER_EMBED_REQUEST. Defaults to MAX_TEXTS_PER_EMBED_REQUEST.
+        max_tokens_per_batch (int): The maximum total number of tokens embedded with a single
+        request. Defaults to 40 000.
+        max_inflight (int): The maximum number of concurrent requests to the embedding API.
+        Defaults to 8.
+        tokenizer_count (int): The number of records tokenized concurrently. Defaults to 4.
+
+    Returns:
+        List[dict]: A list of processed data records, in the order of the input records and
+        their chunks. The 'embedding' of each record is a view of its row in the shared matrix.
+    """
+    batch_size = min(batch_size, MAX_TEXTS_PER_EMBED_REQUEST)
+    record_queue = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+    chunk_queue = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+    batch_queue = asyncio.Queue(max_inflight)
+    result_queue = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+    embedding_matrix = EmbeddingMatrix()
+
+    *_, embedded_records = await asyncio.gather(
+        produce_records(json_data, record_queue, consumer_count=tokenizer_count),
+        *(
+            tokenize_records(
+                record_queue,
+                chunk_queue,
+                text_processor,
+                max_embedding_model_input_length=max_embedding_model_input_length,
+                minimum_chunk_length_in_tokens=minimum_chunk_length_in_tokens,
+            )
+            for _ in range(tokenizer_count)
+        ),
+        batch_chunk_records(
+            chunk_queue,
+            batch_queue,
+            batch_size,
+            max_tokens_per_batch,
+            producer_count=tokenizer_count,
+            consumer_count=max_inflight,
+        ),
+        *(
+            embed_batches(
+                batch_queue, result_queue, text_processor, embedding_matrix, stagger=True
+            )
+            for _ in range(max_inflight)
+        ),
+        collect_embedded_records(result_queue, producer_count=max_inflight),
+    )
+
+    # Batches are packed by length and complete in any order, so the records are sorted back into
+    # their input order and the matrix is trimmed and reordered to match them
+    embedded_records.sort(key=lambda item: item[0])
+    embeddings = embedding_matrix.take([row for _, _, row in embedded_records])
+    # The untrimmed matrix is released before the records are assembled
+    del embedding_matrix
+    processed_data = []
+    for row, (_, record, _) in enumerate(embedded_records):
+        record["embedding_row"] = row
+        record["embedding"] = embeddings[row]
+        processed_data.append(record)
     return processed_data
 
 
-def create_embeddings(
-    scraped_data: Dict[str, str],
+async def create_embeddings(
+    scraped_data: Iterable[Dict[str, str]],
     embedding_model_name: str,
     embedding_type: str,
     max_embedding_model_input_length: int,
     minimum_chunk_length_in_tokens: int,
     cohere_api_key: str,
+    batch_size: int = MAX_TEXTS_PER_EMBED_REQUEST,
+    max_tokens_per_batch: int = 40_000,
+    max_inflight: int = 8,
+    tokenizer_count: int = 4,
+    local_tokenizer_name: str = None,
+    embeddings_cache_file_path: str = None,
+    compress_requests: bool = False,
 ) -> Dict[str, any]:
     """
-    Create embeddings from scraped data using the specified embedding model.
+    Create embeddings from scraped data using the specified embedding model. Embedding requests
+    are sent concurrently over a shared HTTP/2 connection.
     Note: The function is tightly coupled with CohereTextProcessingService.
 
     Args:
-        scraped_data (dict): The scraped data text for which embeddings are to be created.
+        scraped_data (Iterable[dict]): The scraped records for which embeddings are to be
+        created. Can be a lazy iterator.
         embedding_model_name (str): The name of the Cohere model to use for embeddings.
         embedding_type (str): The type of embeddings to use.
         max_embedding_model_input_length (int): Maximum length of the input to the embedding model
         in tokens.
         minimum_chunk_length_in_tokens (int): The minimum chunk length in tokens.
         cohere_api_key (str): The API key for accessing Cohere's services.
-
+        batch_size (int): The maximum number of chunks embedded with a single request.
+        Defaults to MAX_TEXTS_PER_EMBED_REQUEST.
+        max_tokens_per_batch (int): The maximum total number of tokens embedded with a single
+        request. Defaults to 40 000.
+        max_inflight (int): The maximum number of concurrent requests to the embedding API.
+        Defaults to 8.
+        tokenizer_count (int): The number of records tokenized concurrently. Defaults to 4.
+        local_tokenizer_name (str, optional): The name of a Hugging Face tokenizer matching the
+        embedding model. If given, texts are tokenized locally instead of with the Cohere API.
+        embeddings_cache_file_path (str, optional): The path of the SQLite database caching
+        embeddings between runs. If None, embeddings are not cached.
+        compress_requests (bool): Whether to send the texts to the Cohere API gzip-compressed.
+        Defaults to False.
 
     Returns:
         dict: Processed data containing embeddings and their metadata.
     TODO: Decouple the function from CohereTextProcessingService
-    TODO: JSON file with embeddings shouldn't repeat the whole text over and over again
     """
 
-    with requests.Session() as session:
-        session.headers.update(
-            {"Authorization": f"Bearer {cohere_api_key}", "Content-Type": "application/json"}
-        )
-
-        cohere_service = CohereTextProcessingService(
-            session,
-            model_name=embedding_model_name,
-            embedding_type=embedding_type,
-        )
+    async with create_cohere_async_client(cohere_api_key) as async_client:
+        with create_cohere_session(cohere_api_key) as session:
+            cohere_service = CohereTextProcessingService(
+                session,
+                model_name=embedding_model_name,
+                embedding_type=embedding_type,
+                local_tokenizer_name=local_tokenizer_name,
+                async_client=async_client,
+                compress_requests=compress_requests,
+            )
+            if embeddings_cache_file_path:
+                cohere_service = CachedCohereService(cohere_service, embeddings_cache_file_path)
 
-        # Process the file and handle the data
-        processed_data = embed_file_contents(
-            json_data=scraped_data,
-            text_processor=cohere_service,
-            max_embedding_model_input_length=max_embedding_model_input_length,
-            minimum_chunk_length_in_tokens=minimum_chunk_length_in_tokens,
-        )
+            # Process the file and handle the data
+            processed_data = await embed_file_contents(
+                json_data=scraped_data,
+                text_processor=cohere_service,
+                max_embedding_model_input_length=max_embedding_model_input_length,
+                minimum_chunk_length_in_tokens=minimum_chunk_length_in_tokens,
+                batch_size=batch_size,
+                max_tokens_per_batch=max_tokens_per_batch,
+                max_inflight=max_inflight,
+                tokenizer_count=tokenizer_count,
+            )
 
     return processed_data
 
@@ -316,12 +1391,12 @@ def main():
     1. Sets up global logging configuration.
     2. Generates a timestamp for the current run.
     3. Reads configuration parameters and file paths from a YAML file.
-    4. Reads scraped data from a JSON file and preprocesses it by prepending titles and metadata.
+    4. Streams scraped data from a JSON file and preprocesses it by prepending titles and metadata.
     5. Creates text embeddings using the Cohere API by:
         a. Tokenizing the text.
         b. Chunking tokens to fit within the API's maximum input length.
-        c. Detokenizing tokens to reconstruct text chunks.
-        d. Generating embeddings for each chunk.
+        c. Joining token strings to reconstruct text chunks.
+        d. Generating embeddings for batches of chunks.
     6. Saves the generated embeddings and metadata to a specified directory, organized by the
        generated timestamp.
     """
@@ -336,18 +1411,27 @@ def main():
     file_paths = all_parameters["file_paths"]
 
     # Creating embeddings
-    scraped_data = read_json_file(file_paths["embeddings_creator"]["input_scraped_data_file_path"])
-    modified_scraped_data = prepend_title_and_meta_to_text(scraped_data)
+    # Records are streamed from the file and preprocessed lazily as they are consumed
+    scraped_data = iter_json_records(
+        file_paths["embeddings_creator"]["input_scraped_data_file_path"]
+    )
+    modified_scraped_data = map(prepend_title_and_meta_to_record, scraped_data)
     cohere_api_key = os.getenv("COHERE_API_KEY")
-    embeddings_with_metadata = create_embeddings(
-        scraped_data=modified_scraped_data,
-        **config["embeddings_creator"],
-        cohere_api_key=cohere_api_key,
+    embeddings_with_metadata = asyncio.run(
+        create_embeddings(
+            scraped_data=modified_scraped_data,
+            **config["embeddings_creator"],
+            cohere_api_key=cohere_api_key,
+            embeddings_cache_file_path=file_paths["embeddings_creator"][
+                "embeddings_cache_file_path"
+            ],
+        )
     )
     save_embeddings_and_metadata(
         data=embeddings_with_metadata,
         data_dir=file_paths["embeddings_creator"]["output_embeddings_processed_data_dir"],
         timestamp=timestamp,
+        **config["embeddings_storage"],
     )
 
 
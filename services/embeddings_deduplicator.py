@@ -42,7 +42,7 @@ from config.logging_config import setup_global_logger
 from utils.utils import (
     join_data,
     load_embeddings,
-    read_json_file,
+    read_jsonl_file,
     read_yaml_file,
     save_embeddings_and_metadata,
     write_json_file,
@@ -95,11 +95,15 @@ def validate_embeddings(original: List[Dict[str, any]], truncated: List[Dict[str
                 f"Unexpected error. embedding_id: {embedding_id} not found in original data."
             )
 
-        if not np.allclose(
-            np.array(item["embedding"]),
-            np.array(original_by_id[embedding_id]["embedding"]),
-            atol=1e-8,
-        ):
+    if truncated:
+        # All embeddings are compared at once instead of one record at a time
+        truncated_embeddings = np.asarray([item["embedding"] for item in truncated])
+        original_embeddings = np.asarray(
+            [original_by_id[item["embedding_id"]]["embedding"] for item in truncated]
+        )
+        matches = np.isclose(truncated_embeddings, original_embeddings, atol=1e-8).all(axis=1)
+        if not matches.all():
+            embedding_id = truncated[int(np.argmin(matches))]["embedding_id"]
             raise ValueError(
                 f"Embeddings do not closely match for record with embedding_id: {embedding_id}."
             )
@@ -164,21 +168,22 @@ def deduplicate_embeddings(
     original_records_length = len(records)
     duplicate_records = []
     duplicates_found = True
+    # The vectors are stacked once and kept in step with the remaining records
+    vectors = np.ascontiguousarray([record["embedding"] for record in records], dtype=np.float32)
 
     while duplicates_found:
-        vectors = np.array([record["embedding"] for record in records])
         index = build_faiss_index(vectors, use_l2=use_l2_similarity)
-        duplicates_found = False
         distances, indices = index.search(vectors, 2)
-        to_remove = set()
-        duplicate_pairs = []
 
-        for distance_row, index_row in zip(distances, indices):
-            if distance_row[1] < threshold and index_row[1] != -1:
-                larger_index = max(index_row[0], index_row[1])
-                to_remove.add(larger_index)
-                duplicates_found = True
-                duplicate_pairs.append((index_row[0], index_row[1], distance_row[1]))
+        # Pairs of nearest neighbors closer than the threshold are found for all rows at once
+        is_duplicate = (distances[:, 1] < threshold) & (indices[:, 1] != -1)
+        duplicates_found = bool(is_duplicate.any())
+        duplicate_pairs = zip(
+            indices[is_duplicate, 0].tolist(),
+            indices[is_duplicate, 1].tolist(),
+            distances[is_duplicate, 1],
+        )
+        to_remove = set(np.maximum(indices[is_duplicate, 0], indices[is_duplicate, 1]).tolist())
 
         if duplicates_found:
             vectors = np.delete(vectors, list(to_remove), axis=0)
@@ -224,10 +229,9 @@ def main():
     embeddings = load_embeddings(
         file_paths["embeddings_deduplicator"]["input_embeddings_file_path"]
     )
-    metadata = read_json_file(
-        file_paths["embeddings_deduplicator"]["input_embeddings_metadata_file_path"]
-    )
-    embeddings_with_metadata = join_data(records=metadata, embeddings=embeddings)
+    records = read_jsonl_file(file_paths["embeddings_deduplicator"]["input_records_file_path"])
+    chunks = read_jsonl_file(file_paths["embeddings_deduplicator"]["input_chunks_file_path"])
+    embeddings_with_metadata = join_data(records=records, chunks=chunks, embeddings=embeddings)
     unique_records, duplicate_records = deduplicate_embeddings(
         records=embeddings_with_metadata,
         **config["embeddings_deduplicator"],
@@ -242,6 +246,7 @@ def main():
         data=unique_records,
         data_dir=file_paths["embeddings_deduplicator"]["output_embeddings_deduplicated_data_dir"],
         timestamp=timestamp,
+        **config["embeddings_storage"],
     )
 
 
@@ -43,16 +43,18 @@ this project.
 import logging
 import os
 import time
+from array import array
 from typing import Any, Dict, List, Tuple
 
 # Related third-party imports
+import numpy as np
 import pinecone
 from dotenv import load_dotenv
 from tqdm import tqdm
 
 # Local application/library specific imports
 from config.logging_config import setup_global_logger
-from utils.utils import join_data, load_embeddings, read_json_file, read_yaml_file
+from utils.utils import join_data, load_embeddings, read_jsonl_file, read_yaml_file
 
 
 def replace_or_create_pinecone_index(
@@ -118,7 +120,7 @@ def process_metadata(
         if key != "embeddings":
             if value is None:
                 continue  # Skip null values
-            elif isinstance(value, list):
+            elif isinstance(value, (list, array)):
                 meta[key] = [str(v) for v in value]  # Convert all elements in list to string
             elif isinstance(value, (str, int, float, bool)):
                 meta[key] = value
@@ -154,7 +156,7 @@ def prepare_upsert_data(
     for i, record in enumerate(embeddings_data):
         try:
             metadata = process_metadata(record, metadata_to_extract)
-            embedding = tuple(record["embedding"])
+            embedding = tuple(np.asarray(record["embedding"], dtype=np.float64).tolist())
             id = str(i)
             prepared_data.append((id, embedding, metadata))
         except ValueError as e:
@@ -291,10 +293,9 @@ def main():
     # Indexing embeddings
     pinecone_api_key = os.getenv("PINECONE_API_KEY")
     embeddings = load_embeddings(file_paths["embeddings_indexer"]["input_embeddings_file_path"])
-    metadata = read_json_file(
-        file_paths["embeddings_indexer"]["input_embeddings_metadata_file_path"]
-    )
-    embeddings_with_metadata = join_data(records=metadata, embeddings=embeddings)
+    records = read_jsonl_file(file_paths["embeddings_indexer"]["input_records_file_path"])
+    chunks = read_jsonl_file(file_paths["embeddings_indexer"]["input_chunks_file_path"])
+    embeddings_with_metadata = join_data(records=records, chunks=chunks, embeddings=embeddings)
     index_records(
         embeddings_data=embeddings_with_metadata,
         **config["embeddings_indexer"],
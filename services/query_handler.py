@@ -39,11 +39,10 @@ from typing import Any, Dict
 # Related third-party imports
 from dotenv import load_dotenv
 import pinecone
-import requests
 
 # Local application/library specific imports
 from config.logging_config import setup_global_logger
-from services.embeddings_creator import CohereTextProcessingService
+from services.embeddings_creator import CohereTextProcessingService, create_cohere_session
 from utils.utils import read_yaml_file, save_query_results, generate_timestamp
 
 
@@ -97,14 +96,11 @@ def process_query(
     Returns:
     Dict[str, Any]: The result from the Pinecone query.
     """
-    with requests.Session() as session:
-        session.headers.update(
-            {"Authorization": f"Bearer {cohere_api_key}", "Content-Type": "application/json"}
-        )
+    with create_cohere_session(cohere_api_key) as session:
         cohere_service = CohereTextProcessingService(session)
-        query_embedding = cohere_service.get_embedding(
-            user_query, model_name=model_name, embedding_type="search_query"
-        )
+        query_embedding = cohere_service.get_embeddings(
+            [user_query], model_name=model_name, embedding_type="search_query"
+        )[0]
 
     pinecone.init(api_key=pinecone_api_key, environment=pinecone_environment)
     index = pinecone.Index(index_name)
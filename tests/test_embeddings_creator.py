@@ -1,27 +1,55 @@
 # TODO: Ensure the tests are comprehensive
 
+import asyncio
+import gzip
+import json
+import threading
+from array import array
+
+import httpx
+import numpy as np
 import pytest
 import requests
 from services.embeddings_creator import (
+    EMBED_URL,
+    END_OF_STREAM,
+    MAX_RETRY_WAIT,
+    MAX_TEXTS_PER_EMBED_REQUEST,
+    RETRYABLE_STATUS_CODES,
+    CachedCohereService,
+    CohereAPIError,
     CohereTextProcessingService,
+    EmbeddingMatrix,
+    LRUCache,
+    Tokenization,
+    batch_chunk_records,
     chunk_tokens,
+    create_cohere_session,
     embed_file_contents,
+    parse_retry_after,
 )
+from tenacity import wait_none
+from tokenizers import Tokenizer, models, pre_tokenizers
 from unittest.mock import MagicMock
 
 # Mock the Cohere API responses for tokenize, detokenize, and embed endpoints
-TOKENIZE_RESPONSE = {"tokens": [101, 102, 103]}
+TOKENIZE_RESPONSE = {"tokens": [101, 102, 103], "token_strings": ["ex", "ample", " text"]}
 DETOKENIZE_RESPONSE = {"text": "example text"}
 EMBEDDING_RESPONSE = {"embeddings": [[0.1, 0.2, 0.3]]}
 
 
+def mock_async_client(handler):
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
 @pytest.fixture
 def cohere_service(requests_mock):
-    requests_mock.post("https://api.cohere.ai/v1/tokenize", json={"tokens": [101, 102, 103]})
-    requests_mock.post("https://api.cohere.ai/v1/detokenize", json={"text": "example text"})
-    requests_mock.post("https://api.cohere.ai/v1/embed", json={"embeddings": [[0.1, 0.2, 0.3]]})
+    requests_mock.post("https://api.cohere.ai/v1/tokenize", json=TOKENIZE_RESPONSE)
+    requests_mock.post("https://api.cohere.ai/v1/detokenize", json=DETOKENIZE_RESPONSE)
+    requests_mock.post("https://api.cohere.ai/v1/embed", json=EMBEDDING_RESPONSE)
     session = requests.Session()
-    return CohereTextProcessingService(session)
+    async_client = mock_async_client(lambda request: httpx.Response(200, json=EMBEDDING_RESPONSE))
+    return CohereTextProcessingService(session, async_client=async_client)
 
 
 def test_tokenize_text_success(cohere_service):
@@ -29,6 +57,145 @@ def test_tokenize_text_success(cohere_service):
     assert tokens == TOKENIZE_RESPONSE["tokens"], "The token list should match the mocked response"
 
 
+def test_get_tokenization_success(cohere_service):
+    tokenization = cohere_service.get_tokenization("test text")
+    assert (
+        tokenization.ids.tolist() == TOKENIZE_RESPONSE["tokens"]
+    ), "The token list should match the mocked response"
+    assert (
+        tokenization.token_strings() == TOKENIZE_RESPONSE["token_strings"]
+    ), "The token strings should match the mocked response"
+
+
+def test_tokenize_text_is_cached(requests_mock):
+    tokenize_mock = requests_mock.post("https://api.cohere.ai/v1/tokenize", json=TOKENIZE_RESPONSE)
+    cohere_service = CohereTextProcessingService(requests.Session())
+
+    cohere_service.tokenize_text("test text")
+    tokens = cohere_service.tokenize_text("test text")
+
+    assert tokens == TOKENIZE_RESPONSE["tokens"], "The token list should match the mocked response"
+    assert tokenize_mock.call_count == 1, "A repeated text should be tokenized only once"
+
+
+def test_tokenize_text_with_local_tokenizer(requests_mock, monkeypatch):
+    tokenizer = Tokenizer(models.WordLevel({"hello": 0, "world": 1, "[UNK]": 2}, "[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    monkeypatch.setattr(Tokenizer, "from_pretrained", lambda name: tokenizer)
+    tokenize_mock = requests_mock.post("https://api.cohere.ai/v1/tokenize", json=TOKENIZE_RESPONSE)
+    cohere_service = CohereTextProcessingService(
+        requests.Session(), local_tokenizer_name="local-tokenizer"
+    )
+
+    tokenization = cohere_service.get_tokenization(" hello  world!")
+    tokens, token_strings = tokenization.ids.tolist(), tokenization.token_strings()
+
+    assert tokens == [0, 1, 2], "The tokens should come from the local tokenizer"
+    assert token_strings == [" hello  ", "world", "!"], "Token strings should cover the text"
+    assert tokenize_mock.call_count == 0, "The Cohere API should not be called"
+
+
+def test_tokenize_text_is_cached_per_model(requests_mock):
+    tokenize_mock = requests_mock.post("https://api.cohere.ai/v1/tokenize", json=TOKENIZE_RESPONSE)
+    cohere_service = CohereTextProcessingService(requests.Session())
+
+    cohere_service.tokenize_text("test text", model_name="model-a")
+    cohere_service.tokenize_text("test text", model_name="model-b")
+
+    assert tokenize_mock.call_count == 2, "Tokenizations should not be shared between models"
+
+
+def create_local_tokenizer():
+    tokenizer = Tokenizer(models.WordLevel({"hello": 0, "world": 1, "[UNK]": 2}, "[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    return tokenizer
+
+
+def test_tokenize_text_reuses_cached_paragraphs(monkeypatch):
+    local_tokenizer = MagicMock(wraps=create_local_tokenizer())
+    monkeypatch.setattr(Tokenizer, "from_pretrained", lambda name: local_tokenizer)
+    cohere_service = CohereTextProcessingService(
+        requests.Session(), local_tokenizer_name="local-tokenizer"
+    )
+
+    cohere_service.get_tokenization("hello\n\nworld")
+    tokenization = cohere_service.get_tokenization("hello\n\nhello world")
+    tokens, token_strings = tokenization.ids.tolist(), tokenization.token_strings()
+
+    assert tokens == [0, 0, 1], "Paragraph and remaining tokens should be concatenated"
+    assert token_strings == ["hello\n\n", "hello ", "world"], "Token strings should cover the text"
+    assert (
+        local_tokenizer.encode.call_args.args[0] == "hello world"
+    ), "Only the text after the cached paragraph should be tokenized"
+
+
+def test_tokenize_text_does_not_depend_on_cached_paragraphs(monkeypatch):
+    monkeypatch.setattr(Tokenizer, "from_pretrained", lambda name: create_local_tokenizer())
+    text = "hello world\n\nhello\n\n\nworld hello"
+    cold_service = CohereTextProcessingService(
+        requests.Session(), local_tokenizer_name="local-tokenizer"
+    )
+    warm_service = CohereTextProcessingService(
+        requests.Session(), local_tokenizer_name="local-tokenizer"
+    )
+
+    warm_service.get_tokenization("hello world\n\nhello\n\n")
+    warm_service.get_tokenization("hello\n\n")
+
+    warm_tokenization = warm_service.get_tokenization(text)
+    cold_tokenization = cold_service.get_tokenization(text)
+
+    assert (
+        warm_tokenization == cold_tokenization
+    ), "The tokenization should not depend on what is already cached"
+
+
+def test_tokenization_slices_token_strings_from_text():
+    paragraph = Tokenization.from_token_strings([1, 2], ["Nav", "\n\n"])
+    rest = Tokenization.from_token_strings([3, 4, 5], ["Some", " page", " text"])
+
+    tokenization = Tokenization.concatenate([paragraph, rest], "Nav\n\nSome page text")
+
+    assert tokenization.ids == array("i", [1, 2, 3, 4, 5]), "Token ids should be concatenated"
+    assert tokenization.token_strings() == [
+        "Nav",
+        "\n\n",
+        "Some",
+        " page",
+        " text",
+    ], "Token strings should be sliced from the text"
+    assert tokenization.join_token_strings(1, 4) == "\n\nSome page", "Slices should be joined"
+    assert tokenization.join_token_strings(3, 10) == " page text", "Slices should be clamped"
+
+
+def test_get_tokenization_caches_compact_tokenization(monkeypatch):
+    monkeypatch.setattr(Tokenizer, "from_pretrained", lambda name: create_local_tokenizer())
+    cohere_service = CohereTextProcessingService(
+        requests.Session(), local_tokenizer_name="local-tokenizer"
+    )
+    text = "hello\n\nhello world"
+
+    tokenization = cohere_service.get_tokenization(text)
+
+    assert isinstance(tokenization.ids, array), "Token ids should be stored as an array"
+    assert tokenization.text is text, "The cached tokenization should share the text"
+    assert cohere_service.get_tokenization(text) is tokenization, "Tokenizations should be cached"
+
+
+def test_lru_cache_is_bounded_by_size():
+    cache = LRUCache(5, sizeof=len)
+    cache.put("a", [0, 0])
+    cache.put("b", [0, 0])
+    cache.get("a")
+    cache.put("c", [0, 0])
+    cache.put("d", [0] * 6)
+
+    assert cache.get("b") is None, "The least recently used entry should be evicted"
+    assert cache.get("a") == [0, 0] and cache.get("c") == [0, 0], "Recent entries should be kept"
+    assert cache.get("d") is None, "A value larger than the cache should not be cached"
+    assert cache.size == 4, "The cache should track the total size of its values"
+
+
 def test_detokenize_text_success(cohere_service):
     text = cohere_service.detokenize_text([101, 102, 103])
     assert (
@@ -36,11 +203,247 @@ def test_detokenize_text_success(cohere_service):
     ), "The detokenized text should match the mocked response"
 
 
-def test_get_embedding_success(cohere_service):
-    embedding = cohere_service.get_embedding("test text")
+def test_get_embeddings_success(cohere_service):
+    embeddings = cohere_service.get_embeddings(["test text"])
     assert (
-        embedding == EMBEDDING_RESPONSE["embeddings"][0]
-    ), "The embedding should match the mocked response"
+        embeddings == EMBEDDING_RESPONSE["embeddings"]
+    ), "The embeddings should match the mocked response"
+
+
+def test_get_embeddings_retries_transient_errors(requests_mock, monkeypatch):
+    monkeypatch.setattr(CohereTextProcessingService.get_embeddings.retry, "wait", wait_none())
+    embed_mock = requests_mock.post(
+        "https://api.cohere.ai/v1/embed",
+        [{"status_code": 503, "text": "Service unavailable"}, {"json": EMBEDDING_RESPONSE}],
+    )
+    cohere_service = CohereTextProcessingService(requests.Session())
+
+    embeddings = cohere_service.get_embeddings(["test text"])
+
+    assert embeddings == EMBEDDING_RESPONSE["embeddings"], "The retried request should succeed"
+    assert embed_mock.call_count == 2, "The failed request should be retried once"
+
+
+def test_get_embeddings_does_not_retry_client_errors(requests_mock, monkeypatch):
+    monkeypatch.setattr(CohereTextProcessingService.get_embeddings.retry, "wait", wait_none())
+    embed_mock = requests_mock.post(
+        "https://api.cohere.ai/v1/embed", status_code=401, text="Invalid API key"
+    )
+    cohere_service = CohereTextProcessingService(requests.Session())
+
+    with pytest.raises(CohereAPIError) as error:
+        cohere_service.get_embeddings(["test text"])
+
+    assert error.value.status_code == 401, "The error should carry the status code"
+    assert embed_mock.call_count == 1, "A permanent error should not be retried"
+
+
+def test_cohere_session_leaves_embed_retries_to_the_service():
+    session = create_cohere_session("api-key")
+
+    embed_retries = session.get_adapter(EMBED_URL).max_retries
+    tokenize_retries = session.get_adapter("https://api.cohere.ai/v1/tokenize").max_retries
+
+    assert embed_retries.total == 0, "Embed requests should only be retried by the service"
+    assert tokenize_retries.total == 5, "Other requests should be retried by the session"
+    assert set(tokenize_retries.status_forcelist) == set(RETRYABLE_STATUS_CODES)
+
+
+def test_aget_embeddings_honors_retry_after(monkeypatch):
+    sleeps = []
+
+    async def record_sleep(seconds):
+        sleeps.append(seconds)
+
+    monkeypatch.setattr(CohereTextProcessingService.aget_embeddings.retry, "sleep", record_sleep)
+    responses = [
+        httpx.Response(429, headers={"Retry-After": "5"}, text="Too many requests"),
+        httpx.Response(200, json=EMBEDDING_RESPONSE),
+    ]
+    cohere_service = CohereTextProcessingService(
+        requests.Session(), async_client=mock_async_client(lambda request: responses.pop(0))
+    )
+
+    embeddings = asyncio.run(cohere_service.aget_embeddings(["test text"]))
+
+    assert embeddings == EMBEDDING_RESPONSE["embeddings"], "The retried request should succeed"
+    assert sleeps == [5.0], "The retry should wait as long as the Retry-After header requests"
+
+
+def test_aget_embeddings_caps_retry_after(monkeypatch):
+    sleeps = []
+
+    async def record_sleep(seconds):
+        sleeps.append(seconds)
+
+    monkeypatch.setattr(CohereTextProcessingService.aget_embeddings.retry, "sleep", record_sleep)
+    responses = [
+        httpx.Response(429, headers={"Retry-After": "86400"}, text="Too many requests"),
+        httpx.Response(429, headers={"Retry-After": "inf"}, text="Too many requests"),
+        httpx.Response(200, json=EMBEDDING_RESPONSE),
+    ]
+    cohere_service = CohereTextProcessingService(
+        requests.Session(), async_client=mock_async_client(lambda request: responses.pop(0))
+    )
+
+    asyncio.run(cohere_service.aget_embeddings(["test text"]))
+
+    assert sleeps[0] == MAX_RETRY_WAIT, "Long Retry-After delays should be capped"
+    assert sleeps[1] <= MAX_RETRY_WAIT, "Invalid Retry-After delays should fall back to backoff"
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [("5", 5.0), ("-3", 0.0), ("inf", None), ("nan", None), ("soon", None), (None, None)],
+)
+def test_parse_retry_after(value, expected):
+    assert parse_retry_after(value) == expected, "The Retry-After value should be parsed"
+
+
+def test_aget_embeddings_retries_transport_errors(monkeypatch):
+    sleeps = []
+
+    async def record_sleep(seconds):
+        sleeps.append(seconds)
+
+    def embed_handler(request):
+        if not sleeps:
+            raise httpx.ConnectError("Connection refused", request=request)
+        return httpx.Response(200, json=EMBEDDING_RESPONSE)
+
+    monkeypatch.setattr(CohereTextProcessingService.aget_embeddings.retry, "sleep", record_sleep)
+    cohere_service = CohereTextProcessingService(
+        requests.Session(), async_client=mock_async_client(embed_handler)
+    )
+
+    embeddings = asyncio.run(cohere_service.aget_embeddings(["test text"]))
+
+    assert embeddings == EMBEDDING_RESPONSE["embeddings"], "The retried request should succeed"
+    assert len(sleeps) == 1 and sleeps[0] <= 2, "Without Retry-After the retry should back off"
+
+
+def test_aget_embeddings_success(cohere_service):
+    embeddings = asyncio.run(cohere_service.aget_embeddings(["test text"]))
+    assert (
+        embeddings == EMBEDDING_RESPONSE["embeddings"]
+    ), "The embeddings should match the mocked response"
+
+
+def test_aget_embeddings_compresses_large_requests():
+    embed_requests = []
+
+    def embed_handler(request):
+        embed_requests.append(request)
+        return httpx.Response(200, json={"embeddings": [[0.1, 0.2, 0.3]] * 2})
+
+    cohere_service = CohereTextProcessingService(
+        requests.Session(), async_client=mock_async_client(embed_handler), compress_requests=True
+    )
+    texts = ["long text " * 100, "short text"]
+
+    asyncio.run(cohere_service.aget_embeddings(texts))
+
+    assert (
+        embed_requests[0].headers["Content-Encoding"] == "gzip"
+    ), "Large requests should be marked as compressed"
+    assert (
+        json.loads(gzip.decompress(embed_requests[0].content))["texts"] == texts
+    ), "The compressed body should contain the texts"
+
+
+def test_get_embeddings_does_not_compress_by_default(requests_mock):
+    embed_mock = requests_mock.post("https://api.cohere.ai/v1/embed", json=EMBEDDING_RESPONSE)
+    cohere_service = CohereTextProcessingService(requests.Session())
+
+    cohere_service.get_embeddings(["long text " * 100])
+
+    assert (
+        "Content-Encoding" not in embed_mock.last_request.headers
+    ), "Requests should not be compressed unless enabled"
+
+
+def test_get_embeddings_exceeds_batch_limit(cohere_service):
+    with pytest.raises(ValueError):
+        cohere_service.get_embeddings(["test text"] * (MAX_TEXTS_PER_EMBED_REQUEST + 1))
+
+
+def test_cached_service_only_embeds_missing_texts(requests_mock, tmp_path):
+    embed_mock = requests_mock.post(
+        "https://api.cohere.ai/v1/embed",
+        json=lambda request, context: {
+            "embeddings": [[float(len(text)), 0.5] for text in request.json()["texts"]]
+        },
+    )
+    cached_service = CachedCohereService(
+        CohereTextProcessingService(requests.Session()), str(tmp_path / "cache.sqlite3")
+    )
+
+    first = cached_service.get_embeddings(["a", "bb"])
+    second = cached_service.get_embeddings(["bb", "ccc", "a"])
+
+    assert first == [[1.0, 0.5], [2.0, 0.5]], "Embeddings should match the mocked response"
+    assert second == [[2.0, 0.5], [3.0, 0.5], [1.0, 0.5]], "Cached embeddings should keep order"
+    assert embed_mock.call_count == 2, "Each call should send a single request"
+    assert embed_mock.last_request.json()["texts"] == [
+        "ccc"
+    ], "Only texts missing from the cache should be embedded"
+
+
+def test_cached_service_accesses_cache_off_the_event_loop(tmp_path, monkeypatch):
+    def embed_handler(request):
+        texts = json.loads(request.content)["texts"]
+        return httpx.Response(
+            200, json={"embeddings": [[float(len(text)), 0.5] for text in texts]}
+        )
+
+    cached_service = CachedCohereService(
+        CohereTextProcessingService(
+            requests.Session(), async_client=mock_async_client(embed_handler)
+        ),
+        str(tmp_path / "cache.sqlite3"),
+    )
+    cache_threads = []
+    for method_name in ("lookup", "store"):
+        method = getattr(cached_service, method_name)
+
+        def record_thread(*args, method=method):
+            cache_threads.append(threading.get_ident())
+            return method(*args)
+
+        monkeypatch.setattr(cached_service, method_name, record_thread)
+
+    async def embed_twice():
+        first = await cached_service.aget_embeddings(["a", "bb"])
+        second = await cached_service.aget_embeddings(["bb", "ccc"])
+        return first, second, threading.get_ident()
+
+    first, second, event_loop_thread = asyncio.run(embed_twice())
+
+    assert first == [[1.0, 0.5], [2.0, 0.5]], "Embeddings should match the mocked response"
+    assert second == [[2.0, 0.5], [3.0, 0.5]], "Cached embeddings should keep order"
+    assert len(cache_threads) == 4, "Each call should look up and store once"
+    assert event_loop_thread not in cache_threads, "The cache shouldn't block the event loop"
+
+
+def test_cache_key_is_namespaced_by_model():
+    assert CachedCohereService.cache_key(
+        "text", "model-a", "search_document"
+    ) != CachedCohereService.cache_key(
+        "text", "model-b", "search_document"
+    ), "The same text embedded by different models should have different keys"
+
+
+def test_embedding_matrix_grows_and_takes_rows():
+    embedding_matrix = EmbeddingMatrix(initial_capacity=2)
+
+    first_rows = embedding_matrix.append([[0.0, 0.5], [1.0, 0.5]])
+    second_rows = embedding_matrix.append([[2.0, 0.5], [3.0, 0.5], [4.0, 0.5]])
+    embeddings = embedding_matrix.take([4, 0, 2])
+
+    assert list(first_rows) == [0, 1] and list(second_rows) == [2, 3, 4], "Rows should be appended"
+    assert len(embedding_matrix.values) == 8, "The capacity should double until the rows fit"
+    assert embeddings.dtype == np.float32, "Embeddings should be stored as float32"
+    assert embeddings[:, 0].tolist() == [4.0, 0.0, 2.0], "Rows should be taken in the given order"
 
 
 def test_chunk_tokens():
@@ -54,12 +457,108 @@ def test_chunk_tokens():
     ), "Each chunk size should not exceed max_size"
 
 
-# TODO: Fix the test
+def test_batch_chunk_records_respects_token_budget():
+    lengths = [5, 1, 4, 2, 3, 1]
+
+    async def run_batching():
+        chunk_queue, batch_queue = asyncio.Queue(), asyncio.Queue()
+        for position, length in enumerate(lengths):
+            chunk_queue.put_nowait((position, {"tokenized_chunk": [0] * length}))
+        chunk_queue.put_nowait(END_OF_STREAM)
+        await batch_chunk_records(chunk_queue, batch_queue, batch_size=3, max_tokens_per_batch=5)
+        batches = []
+        while (batch := batch_queue.get_nowait()) is not END_OF_STREAM:
+            batches.append(batch)
+        return batches
+
+    batches = asyncio.run(run_batching())
+
+    assert all(
+        len(batch) <= 3 for batch in batches
+    ), "Each batch should hold at most batch_size records"
+    assert all(
+        sum(len(record["tokenized_chunk"]) for _, record in batch) <= 5 for batch in batches
+    ), "Each batch should fit within the token budget"
+    assert [[lengths[position] for position, _ in batch] for batch in batches] == [
+        [1, 1, 2],
+        [3],
+        [4],
+        [5],
+    ], "Records should be packed by length"
+    assert sorted(position for batch in batches for position, _ in batch) == list(
+        range(len(lengths))
+    ), "Every record should be batched exactly once with its input position"
+
+
 def test_embed_file_contents_success(cohere_service):
     json_data = [{"text": "test text"}]
-    processed_data = embed_file_contents(json_data, cohere_service)
+    processed_data = asyncio.run(
+        embed_file_contents(json_data, cohere_service, minimum_chunk_length_in_tokens=1)
+    )
     assert len(processed_data) == 1, "Should process one record"
     assert "embedding" in processed_data[0], "Processed data should contain embeddings"
+    assert (
+        processed_data[0]["detokenized_chunk"] == "example text"
+    ), "The chunk text should be joined from the token strings"
+    assert processed_data[0]["tokenized_chunk"] == array(
+        "i", TOKENIZE_RESPONSE["tokens"]
+    ), "Chunk tokens should be stored as a compact array"
+
+
+def test_embed_file_contents_accepts_iterator(cohere_service):
+    json_data = (record for record in [{"text": "test text"}])
+    processed_data = asyncio.run(
+        embed_file_contents(json_data, cohere_service, minimum_chunk_length_in_tokens=1)
+    )
+    assert len(processed_data) == 1, "Should process records streamed from an iterator"
+
+
+def test_embed_file_contents_batches_preserve_order(requests_mock):
+    requests_mock.post(
+        "https://api.cohere.ai/v1/tokenize",
+        json={"tokens": [101, 102, 103], "token_strings": ["101", "102", "103"]},
+    )
+    detokenize_mock = requests_mock.post(
+        "https://api.cohere.ai/v1/detokenize", json=DETOKENIZE_RESPONSE
+    )
+    embed_requests = []
+
+    def embed_handler(request):
+        embed_requests.append(request)
+        texts = json.loads(request.content)["texts"]
+        return httpx.Response(200, json={"embeddings": [[float(text)] for text in texts]})
+
+    cohere_service = CohereTextProcessingService(
+        requests.Session(), async_client=mock_async_client(embed_handler)
+    )
+    json_data = [{"text": f"text {i}"} for i in range(5)]
+
+    processed_data = asyncio.run(
+        embed_file_contents(
+            json_data,
+            cohere_service,
+            max_embedding_model_input_length=1,
+            minimum_chunk_length_in_tokens=1,
+            batch_size=4,
+        )
+    )
+
+    assert len(embed_requests) == 4, "15 chunks in batches of 4 should need 4 requests"
+    assert detokenize_mock.call_count == 0, "Chunks should be reconstructed without detokenizing"
+    assert [record["embedding_id"] for record in processed_data] == [
+        f"{i}_{k}" for i in range(5) for k in range(3)
+    ], "Processed records should keep the order of records and chunks"
+    assert all(
+        record["embedding"].tolist() == [float(record["detokenized_chunk"])]
+        for record in processed_data
+    ), "Each record should receive the embedding of its own chunk"
+    assert [record["embedding_row"] for record in processed_data] == list(
+        range(15)
+    ), "Embedding rows should follow the order of the records"
+    assert all(
+        record["embedding"].base is processed_data[0]["embedding"].base
+        for record in processed_data
+    ), "Embeddings should be views of a single matrix"
 
 
 def test_tokenize_text_exceeds_limit(cohere_service, caplog):
@@ -31,8 +31,8 @@ def test_parse_query_results(input_data, expected_output):
 @pytest.fixture
 def mock_cohere_service(mocker):
     mock = mocker.patch(
-        "services.query_handler.CohereTextProcessingService.get_embedding",
-        return_value=[0.1, 0.2, 0.3],
+        "services.query_handler.CohereTextProcessingService.get_embeddings",
+        return_value=[[0.1, 0.2, 0.3]],
     )
     return mock
 
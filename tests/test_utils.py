@@ -0,0 +1,158 @@
+import os
+from array import array
+
+import h5py
+import numpy as np
+
+from utils.utils import (
+    dequantize_embeddings,
+    join_data,
+    load_embeddings,
+    quantize_embeddings,
+    read_jsonl_file,
+    save_embeddings_and_metadata,
+)
+
+
+def create_processed_records():
+    return [
+        {
+            "url": "https://example.com/a",
+            "title": "Page A",
+            "record_id": "a",
+            "chunk_index": 0,
+            "tokenized_chunk": array("i", [1, 2]),
+            "detokenized_chunk": "first chunk",
+            "embedding_id": "a-0",
+            "embedding": [0.1, 0.2, 0.3],
+        },
+        {
+            "url": "https://example.com/a",
+            "title": "Page A",
+            "record_id": "a",
+            "chunk_index": 1,
+            "tokenized_chunk": array("i", [3]),
+            "detokenized_chunk": "second chunk",
+            "embedding_id": "a-1",
+            "embedding": [0.4, 0.5, 0.6],
+        },
+        {
+            "url": "https://example.com/b",
+            "title": "Page B",
+            "record_id": "b",
+            "chunk_index": 0,
+            "tokenized_chunk": array("i", [4, 5, 6]),
+            "detokenized_chunk": "only chunk",
+            "embedding_id": "b-0",
+            "embedding": [0.7, 0.8, 0.9],
+        },
+    ]
+
+
+def save_and_reload(data, data_dir, **kwargs):
+    save_embeddings_and_metadata(data, str(data_dir), **kwargs)
+    records = read_jsonl_file(os.path.join(data_dir, "processed_records.jsonl"))
+    chunks = read_jsonl_file(os.path.join(data_dir, "processed_chunks.jsonl"))
+    embeddings = load_embeddings(os.path.join(data_dir, "processed_embeddings_values.h5"))
+    return records, chunks, embeddings
+
+
+def test_save_and_join_data_round_trip(tmp_path):
+    data = create_processed_records()
+
+    records, chunks, embeddings = save_and_reload(data, tmp_path)
+    joined_data = join_data(records, chunks, embeddings)
+
+    assert [record["record_id"] for record in records] == [
+        "a",
+        "b",
+    ], "Each source record should be written once"
+    assert records[0] == {
+        "url": "https://example.com/a",
+        "title": "Page A",
+        "record_id": "a",
+    }, "Source records shouldn't contain chunk keys"
+    assert [chunk["embedding_row"] for chunk in chunks] == [0, 1, 2], "Rows should be in order"
+    assert embeddings.dtype == np.float32, "Embeddings should be stored as float32"
+    assert len(joined_data) == len(data), "There should be one joined record per chunk"
+    for original, joined in zip(data, joined_data):
+        for key in ("url", "title", "record_id", "chunk_index", "detokenized_chunk"):
+            assert joined[key] == original[key], f"'{key}' should survive the round trip"
+        assert joined["tokenized_chunk"] == original["tokenized_chunk"].tolist()
+        np.testing.assert_allclose(joined["embedding"], original["embedding"], rtol=1e-6)
+
+
+def test_save_and_join_data_without_record_ids(tmp_path):
+    data = [
+        {"text": "first page", "embedding": [1.0, 0.0]},
+        {"text": "second page", "embedding": [0.0, 1.0]},
+    ]
+
+    records, chunks, embeddings = save_and_reload(data, tmp_path)
+    joined_data = join_data(records, chunks, embeddings)
+
+    assert len(records) == 2, "Records without a record_id should each be written"
+    assert [record["text"] for record in joined_data] == ["first page", "second page"]
+    np.testing.assert_array_equal(
+        np.stack([record["embedding"] for record in joined_data]), [[1.0, 0.0], [0.0, 1.0]]
+    )
+
+
+def test_save_and_join_data_with_and_without_record_ids(tmp_path):
+    data = [
+        {"text": "page without id", "embedding": [1.0, 0.0]},
+        {"text": "page with id", "record_id": 0, "embedding": [0.0, 1.0]},
+        {"text": "page with id", "record_id": 0, "embedding": [0.5, 0.5]},
+    ]
+
+    records, chunks, embeddings = save_and_reload(data, tmp_path)
+    joined_data = join_data(records, chunks, embeddings)
+
+    assert len(records) == 2, "A missing record_id shouldn't collide with an existing one"
+    assert [record["text"] for record in joined_data] == [
+        "page without id",
+        "page with id",
+        "page with id",
+    ], "Chunks should join to their own source records"
+
+
+def test_quantize_embeddings_round_trip_within_half_a_scale():
+    embeddings = np.random.default_rng(0).standard_normal((8, 16)).astype(np.float32)
+
+    quantized_embeddings, scales = quantize_embeddings(embeddings)
+    restored_embeddings = dequantize_embeddings(quantized_embeddings, scales)
+
+    assert quantized_embeddings.dtype == np.int8, "Embeddings should be quantized to int8"
+    assert scales.dtype == np.float32, "Scales should be float32"
+    assert np.all(np.abs(quantized_embeddings).max(axis=1) == 127), "Maxima should map to 127"
+    errors = np.abs(restored_embeddings - embeddings)
+    assert np.all(errors <= scales[:, None] / 2 + 1e-6), "Errors should be within half a scale"
+
+
+def test_quantize_embeddings_keeps_zero_vectors():
+    embeddings = np.array([[0.0, 0.0, 0.0], [0.5, -1.0, 0.25]], dtype=np.float32)
+
+    quantized_embeddings, scales = quantize_embeddings(embeddings)
+    restored_embeddings = dequantize_embeddings(quantized_embeddings, scales)
+
+    assert np.all(np.isfinite(scales)), "Zero vectors shouldn't produce invalid scales"
+    np.testing.assert_array_equal(restored_embeddings[0], [0.0, 0.0, 0.0])
+
+
+def test_save_and_load_quantized_embeddings(tmp_path):
+    data = create_processed_records()
+    data.append({"record_id": "c", "embedding": [0.0, 0.0, 0.0]})
+
+    records, chunks, embeddings = save_and_reload(data, tmp_path, quantize=True)
+
+    with h5py.File(tmp_path / "processed_embeddings_values.h5", "r") as file:
+        assert file["embeddings"].dtype == np.int8, "Embeddings should be stored as int8"
+        assert file["scales"].dtype == np.float32, "Scales should be stored as float32"
+        assert file["scales"].shape == (len(data),), "There should be one scale per embedding"
+        scales = file["scales"][:]
+    assert embeddings.dtype == np.float32, "Loaded embeddings should be dequantized"
+    original_embeddings = np.array([record["embedding"] for record in data], dtype=np.float32)
+    assert np.all(np.abs(embeddings - original_embeddings) <= scales[:, None] / 2 + 1e-6)
+    np.testing.assert_array_equal(embeddings[-1], [0.0, 0.0, 0.0])
+    joined_data = join_data(records, chunks, embeddings)
+    assert [record["embedding_id"] for record in joined_data[:3]] == ["a-0", "a-1", "b-0"]
@@ -1,14 +1,40 @@
 # Standard library imports
 import datetime
-import json
+import itertools
 import logging
 import os
-from typing import Any, Dict, List
+from array import array
+from collections import ChainMap
+from typing import Any, Dict, Iterator, List, Mapping, Tuple
 
 # Related third-party imports
 import h5py
+import ijson
+import numpy as np
+import orjson
 import yaml
 
+# Keys of a processed record that describe its chunk rather than the source record
+CHUNK_KEYS = ("record_id", "chunk_index", "tokenized_chunk", "detokenized_chunk", "embedding_id")
+
+
+def serialize_json_default(value: Any) -> Any:
+    """Converts values that orjson doesn't serialize natively, such as token arrays. Passed to
+    orjson as the `default` callable.
+
+    Args:
+        value (Any): The value to convert.
+
+    Returns:
+        Any: A JSON serializable equivalent of the value.
+
+    Raises:
+        TypeError: If the value can't be converted.
+    """
+    if isinstance(value, array):
+        return value.tolist()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
 
 def read_json_file(file_path: str) -> List[Dict[str, Any]]:
     """Reads a JSON file and returns its content.
@@ -23,13 +49,53 @@ def read_json_file(file_path: str) -> List[Dict[str, Any]]:
         IOError: If there is an error reading the JSON file.
     """
     try:
-        with open(file_path, "r") as file:
-            data = json.load(file)
+        with open(file_path, "rb") as file:
+            data = orjson.loads(file.read())
         return data
     except IOError as e:
         raise IOError(f"Error reading JSON file: {e}")
 
 
+def iter_json_records(file_path: str) -> Iterator[Dict[str, Any]]:
+    """Incrementally parses a JSON file containing a list of records, yielding one record at a
+    time. Unlike read_json_file, the whole file is never loaded into memory.
+
+    Args:
+        file_path (str): The path of the JSON file to read.
+
+    Yields:
+        Dict[str, Any]: The next record of the JSON file.
+
+    Raises:
+        IOError: If there is an error reading the JSON file.
+    """
+    try:
+        with open(file_path, "rb") as file:
+            # Floats are parsed as Python floats rather than decimals, matching read_json_file
+            yield from ijson.items(file, "item", use_float=True)
+    except IOError as e:
+        raise IOError(f"Error reading JSON file: {e}")
+
+
+def read_jsonl_file(file_path: str) -> List[Dict[str, Any]]:
+    """Reads a JSON Lines file and returns its records.
+
+    Args:
+        file_path (str): The path of the JSON Lines file to read.
+
+    Returns:
+        List[Dict[str, Any]]: The records of the JSON Lines file, one per line.
+
+    Raises:
+        IOError: If there is an error reading the JSON Lines file.
+    """
+    try:
+        with open(file_path, "rb") as file:
+            return [orjson.loads(line) for line in file if line.strip()]
+    except IOError as e:
+        raise IOError(f"Error reading JSON Lines file: {e}")
+
+
 def write_json_file(data: List[dict], file_path: str, timestamp: str = None):
     """Writes the given data to a JSON file. Optionally appends a timestamp to the filename.
 
@@ -43,8 +109,16 @@ def write_json_file(data: List[dict], file_path: str, timestamp: str = None):
         file_path = f"{file_name}_{timestamp}{file_extension}"
 
     os.makedirs(os.path.dirname(file_path), exist_ok=True)
-    with open(file_path, "w", encoding="utf-8") as file:
-        json.dump(data, file, indent=4)
+    with open(file_path, "wb") as file:
+        file.write(
+            orjson.dumps(
+                data,
+                default=serialize_json_default,
+                option=orjson.OPT_INDENT_2
+                | orjson.OPT_SERIALIZE_NUMPY
+                | orjson.OPT_APPEND_NEWLINE,
+            )
+        )
         logging.info(f"Data written to {file_path}")
 
 
@@ -69,44 +143,82 @@ def read_yaml_file(file_path):
         return None
 
 
-def load_embeddings(file_path: str) -> Dict[str, Any]:
-    """Reads an HDF5 file and returns a dictionary of embeddings.
+def quantize_embeddings(embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Quantizes embeddings to int8 with a symmetric scale per embedding, so that the largest
+    absolute value of each embedding maps to 127.
+
+    Args:
+        embeddings (np.ndarray): A float32 matrix of embeddings.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: An int8 matrix of quantized embeddings and a float32 vector
+        of their scales.
+    """
+    scales = np.max(np.abs(embeddings), axis=1) / 127.0
+    # Embeddings of only zeros are kept as zeros instead of dividing by a zero scale
+    scales[scales == 0] = 1.0
+    quantized_embeddings = np.round(embeddings / scales[:, None]).astype(np.int8)
+    return quantized_embeddings, scales.astype(np.float32)
+
+
+def dequantize_embeddings(quantized_embeddings: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    """Restores float32 embeddings from their int8 quantization.
+
+    Args:
+        quantized_embeddings (np.ndarray): An int8 matrix of quantized embeddings.
+        scales (np.ndarray): A float32 vector of the scales of the embeddings.
+
+    Returns:
+        np.ndarray: A float32 matrix of embeddings.
+    """
+    return quantized_embeddings.astype(np.float32) * scales[:, None]
+
+
+def load_embeddings(file_path: str) -> np.ndarray:
+    """Reads an HDF5 file and returns its matrix of embeddings. Embeddings saved quantized to int8
+    are dequantized.
 
     Args:
         file_path (str): The path of the HDF5 file to read.
 
     Returns:
-        Dict[str, Any]: A dictionary of embeddings keyed by embedding_id.
+        np.ndarray: A float32 matrix of embeddings with one row per record.
 
     Raises:
         IOError: If there is an error reading the HDF5 file.
     """
-    embeddings = {}
     try:
         with h5py.File(file_path, "r") as file:
-            for key in file.keys():
-                embeddings[key] = file[key][:]
-        return embeddings
+            if "scales" in file:
+                return dequantize_embeddings(file["embeddings"][:], file["scales"][:])
+            return file["embeddings"][:]
     except IOError as e:
         raise IOError(f"Error reading HDF5 file: {e}")
 
 
-def join_data(records: List[Dict[str, Any]], embeddings: Dict[str, Any]) -> List[Dict[str, Any]]:
-    """Joins records with their corresponding embeddings based on the embedding_id.
+def join_data(
+    records: List[Dict[str, Any]], chunks: List[Dict[str, Any]], embeddings: np.ndarray
+) -> List[Mapping[str, Any]]:
+    """Joins chunks with their source records, based on the record_id, and with their
+    corresponding embeddings, based on the embedding_row.
 
     Args:
-        records (List[Dict[str, Any]]): A list of records from the JSON file.
-        embeddings (Dict[str, Any]): A dictionary of embeddings from the HDF5 file.
+        records (List[Dict[str, Any]]): A list of source records from the JSON Lines file.
+        chunks (List[Dict[str, Any]]): A list of chunks from the JSON Lines file.
+        embeddings (np.ndarray): A matrix of embeddings from the HDF5 file.
 
     Returns:
-        List[Dict[str, Any]]: A list of records with embeddings added to them.
+        List[Mapping[str, Any]]: A list of processed records, one per chunk. Each one is a view
+        of the chunk, with its embedding, layered over the shared source record.
     """
-    for record in records:
-        embedding_id = record.get("embedding_id")
-        record["embedding"] = embeddings.get(
-            embedding_id, None
-        )  # None if embedding_id is not found
-    return records
+    records_by_id = {record["record_id"]: record for record in records}
+    return [
+        ChainMap(
+            {**chunk, "embedding": embeddings[chunk["embedding_row"]]},
+            records_by_id[chunk["record_id"]],
+        )
+        for chunk in chunks
+    ]
 
 
 def validate_embedding_dimensions(embeddings_data: List[Dict[str, Any]]) -> None:
@@ -125,29 +237,44 @@ def validate_embedding_dimensions(embeddings_data: List[Dict[str, Any]]) -> None
         raise ValueError("No data to validate.")
 
     embedding_length = len(embeddings_data[0]["embedding"])
-    for record in embeddings_data:
-        if not all(isinstance(x, float) for x in record["embedding"]):
-            raise ValueError("Embeddings must be floats.")
-        if len(record["embedding"]) != embedding_length:
-            raise ValueError("Inconsistent embedding dimensions found.")
+    if any(len(record["embedding"]) != embedding_length for record in embeddings_data):
+        raise ValueError("Inconsistent embedding dimensions found.")
+    # Stacking the embeddings checks the type of all values at once
+    embeddings = np.asarray([record["embedding"] for record in embeddings_data])
+    if not np.issubdtype(embeddings.dtype, np.floating):
+        raise ValueError("Embeddings must be floats.")
 
 
 def save_embeddings_and_metadata(
-    data: List[Dict[str, Any]],
+    data: List[Mapping[str, Any]],
     data_dir: str,
-    metadata_file_name: str = "processed_metadata",
+    records_file_name: str = "processed_records",
+    chunks_file_name: str = "processed_chunks",
     embeddings_file_name: str = "processed_embeddings_values",
     timestamp: str = None,
+    quantize: bool = False,
 ) -> None:
-    """Saves data into separate JSON and HDF5 files in the specified directory. Optionally appends
-    a timestamp to the filenames.
+    """Saves data into separate JSON Lines and HDF5 files in the specified directory. Optionally
+    appends a timestamp to the filenames.
+
+    The data is normalized so that nothing is repeated across the chunks of a source record:
+    - the records file stores each source record once, identified by its 'record_id'. Records
+      without one are given a new integer id, following the largest existing integer id,
+    - the chunks file stores the chunk keys (CHUNK_KEYS) of each processed record, together with
+      the 'embedding_row' it refers to,
+    - the HDF5 file stores the embeddings as a single contiguous float32 dataset named
+      'embeddings', with one row per chunk. If quantize is True, the dataset holds int8
+      embeddings instead, and a float32 dataset named 'scales' holds their scales.
 
     Args:
-        data (List[Dict[str, Any]]): The data to be saved.
+        data (List[Mapping[str, Any]]): The data to be saved.
         data_dir (str): The directory where the data will be saved.
-        metadata_file_name (str): The desired file name of the metadata.
+        records_file_name (str): The desired file name of the source records.
+        chunks_file_name (str): The desired file name of the chunks.
         embeddings_file_name (str): The desired file name of the embeddings.
         timestamp (str, optional): Timestamp string to append to the filenames.
+        quantize (bool): Whether to store the embeddings quantized to int8, taking 4 times less
+        space. Defaults to False.
 
     Raises:
         ValueError: If data is empty or improperly formatted.
@@ -157,29 +284,75 @@ def save_embeddings_and_metadata(
         raise ValueError("No data provided for saving.")
 
     if timestamp:
-        metadata_file_name += f"_{timestamp}"
+        records_file_name += f"_{timestamp}"
+        chunks_file_name += f"_{timestamp}"
         embeddings_file_name += f"_{timestamp}"
 
-    json_file_path = os.path.join(data_dir, f"{metadata_file_name}.json")
+    records_file_path = os.path.join(data_dir, f"{records_file_name}.jsonl")
+    chunks_file_path = os.path.join(data_dir, f"{chunks_file_name}.jsonl")
     hdf5_file_path = os.path.join(data_dir, f"{embeddings_file_name}.h5")
 
     try:
-        with h5py.File(hdf5_file_path, "w") as hdf5_file, open(json_file_path, "w") as json_file:
-            json_data = []
-            for i, record in enumerate(data):
-                if "embedding" not in record:
-                    raise ValueError(f"Missing 'embedding' key in record {i}")
-
-                dataset_name = f"embedding_{i}"
-                json_record = {key: record[key] for key in record if key != "embedding"}
-                json_record["embedding_id"] = dataset_name
-                json_data.append(json_record)
-                hdf5_file.create_dataset(dataset_name, data=record["embedding"])
+        for i, record in enumerate(data):
+            if "embedding" not in record:
+                raise ValueError(f"Missing 'embedding' key in record {i}")
+        embeddings = np.asarray([record["embedding"] for record in data], dtype=np.float32)
+        if embeddings.ndim != 2:
+            raise ValueError("Inconsistent embedding dimensions found.")
 
-            json.dump(json_data, json_file, indent=4)
+        os.makedirs(data_dir, exist_ok=True)
+        with h5py.File(hdf5_file_path, "w") as hdf5_file:
+            if quantize:
+                embeddings, scales = quantize_embeddings(embeddings)
+                hdf5_file.create_dataset("scales", data=scales)
+            hdf5_file.create_dataset(
+                "embeddings",
+                data=embeddings,
+                chunks=(min(1024, embeddings.shape[0]), embeddings.shape[1]),
+                compression="lzf",
+            )
+
+        # Records without a record_id are treated as their own source record, with new ids
+        # following the existing ones so that they can't be mistaken for another record
+        existing_ids = [
+            record["record_id"] for record in data if isinstance(record.get("record_id"), int)
+        ]
+        new_record_ids = itertools.count(max(existing_ids, default=-1) + 1)
+        saved_record_ids = set()
+        with open(records_file_path, "wb") as records_file, open(
+            chunks_file_path, "wb"
+        ) as chunks_file:
+            for i, record in enumerate(data):
+                record_id = record["record_id"] if "record_id" in record else next(new_record_ids)
+                if record_id not in saved_record_ids:
+                    source_record = {
+                        key: value
+                        for key, value in record.items()
+                        if key not in CHUNK_KEYS and key not in ("embedding", "embedding_row")
+                    }
+                    source_record["record_id"] = record_id
+                    records_file.write(
+                        orjson.dumps(
+                            source_record,
+                            default=serialize_json_default,
+                            option=orjson.OPT_APPEND_NEWLINE,
+                        )
+                    )
+                    saved_record_ids.add(record_id)
+
+                chunk = {key: record[key] for key in CHUNK_KEYS if key in record}
+                chunk["record_id"] = record_id
+                chunk["embedding_row"] = i
+                # Token arrays of the chunks are written as lists
+                chunks_file.write(
+                    orjson.dumps(
+                        chunk, default=serialize_json_default, option=orjson.OPT_APPEND_NEWLINE
+                    )
+                )
 
         logging.info(
-            f"Metadata and embeddings' values saved to:\n{json_file_path}\n{hdf5_file_path}"
+            "Records, chunks and embeddings' values saved to:\n"
+            f"{records_file_path}\n{chunks_file_path}\n{hdf5_file_path}"
         )
     except Exception as e:
         logging.error(f"Error occurred while saving data: {e}")
@@ -208,6 +381,28 @@ def read_markdown_file(file_path: str) -> str:
         return f"An error occurred: {e}"
 
 
+def prepend_title_and_meta_to_record(item: Dict[str, str]) -> Dict[str, str]:
+    """Adds 'title', 'meta_description' and 'text' of a single record, ignoring non-string types.
+    It modifies the 'text' field in-place.
+
+    Args:
+        item: A dictionary with potential 'title', 'meta_description', and 'text' keys.
+
+    Returns:
+        The modified dictionary with 'title' and 'meta_description' prepended to 'text' where
+        applicable.
+    """
+    components = []
+
+    for key in ["title", "meta_description", "text"]:
+        if isinstance(item.get(key), str):
+            components.append(item[key])
+
+    item["text"] = "".join(components)
+
+    return item
+
+
 def prepend_title_and_meta_to_text(data_list: List[Dict[str, str]]) -> List[Dict[str, str]]:
     """Adds 'title', 'meta_description' and 'text' in each dictionary of a list, ignoring non-
     string types.
@@ -226,13 +421,7 @@ def prepend_title_and_meta_to_text(data_list: List[Dict[str, str]]) -> List[Dict
     """
 
     for item in data_list:
-        components = []
-
-        for key in ["title", "meta_description", "text"]:
-            if isinstance(item.get(key), str):
-                components.append(item[key])
-
-        item["text"] = "".join(components)
+        prepend_title_and_meta_to_record(item)
 
     return data_list
 